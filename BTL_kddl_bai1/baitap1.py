@@ -1,8 +1,9 @@
 import pandas as pd
 import numpy as np
-from scipy import stats
 from datetime import datetime
-import re
+
+from survey_parsing import parse_column
+from survey_stats import bootstrap_ci, format_report, summarize
 
 # Cấu hình cơ bản
 CSV_PATH = "Student Insomnia and Educational Outcomes Dataset.csv"
@@ -11,58 +12,26 @@ HOURS_COL = "4. On average, how many hours of sleep do you get on a typical day?
 ALPHA = 0.05
 MU0 = 8.0
 
-# Hàm chuyển đổi dữ liệu giờ ngủ sang số
-def map_hours_to_numeric(s):
-    if pd.isna(s):
-        return np.nan
-    text = str(s).strip().lower()
-    text = text.replace("–", "-").replace("—", "-")
-    text = re.sub(r"\bhours?\b", "", text).strip()
-
-    m = re.search(r"(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)", text)
-    if m:
-        a, b = float(m.group(1)), float(m.group(2))
-        return (a + b) / 2.0
-
-    m = re.search(r"\b(less than|under|<)\s*(\d+(?:\.\d+)?)\b", text)
-    if m:
-        x = float(m.group(2))
-        return max(0.0, x - 0.5)
-
-    m = re.search(r"\b(more than|over|above|>)\s*(\d+(?:\.\d+)?)\b", text)
-    if m:
-        x = float(m.group(2))
-        return x + 0.5
-
-    m = re.search(r"\b(\d+(?:\.\d+)?)\s*\+\b", text)
-    if m:
-        x = float(m.group(1))
-        return x + 0.5
-
-    m = re.search(r"\b(\d+(?:\.\d+)?)\b", text)
-    if m:
-        return float(m.group(1))
-
-    return np.nan
-
 def line():
     return "-" * 72
 
-# Đọc dữ liệu
-df_full = pd.read_csv(CSV_PATH)
+# Đọc dữ liệu: các cột câu trả lời khảo sát ("1. ...", "2. ...") đọc thẳng thành category
+header = pd.read_csv(CSV_PATH, nrows=0).columns
+answer_cols = [c for c in header if c.split(".")[0].strip().isdigit()]
+df_full = pd.read_csv(CSV_PATH, dtype={c: "category" for c in answer_cols})
 
 # Lọc sinh viên đại học
 if YEAR_COL in df_full.columns:
-    year_clean = df_full[YEAR_COL].astype(str).str.strip().str.lower()
+    # .str trên cột category chỉ xử lý các giá trị khác nhau
+    year_clean = df_full[YEAR_COL].str.strip().str.lower()
     mask_undergrad = (year_clean != "graduate student") & (year_clean != "graduate") & (year_clean != "postgraduate")
     removed = (~mask_undergrad).sum()
-    df = df_full.loc[mask_undergrad].reset_index(drop=True)
+    work = df_full.loc[mask_undergrad].reset_index(drop=True)
 else:
     removed = 0
-    df = df_full.copy()
-
-work = df.copy()
-work['hours_numeric'] = work[HOURS_COL].apply(map_hours_to_numeric)
+    work = df_full
+del df_full
+work['hours_numeric'] = parse_column(work[HOURS_COL])
 hours = work['hours_numeric'].dropna().to_numpy()
 
 # Báo cáo kết quả
@@ -75,7 +44,7 @@ report_lines.append(f"Số dòng loại bỏ (không phải ĐH): {removed}")
 report_lines.append(f"Tổng số bản ghi (ĐH): {len(work)}")
 report_lines.append(f"Số bản ghi hợp lệ về giờ ngủ: {len(hours)}")
 report_lines.append("Tần suất các câu trả lời cột giờ ngủ:")
-for k, v in work[HOURS_COL].value_counts(dropna=False).items():
+for k, v in work[HOURS_COL].cat.remove_unused_categories().value_counts(dropna=False).items():
     report_lines.append(f"  - {k}: {v}")
 
 # Chuẩn hóa dữ liệu
@@ -110,14 +79,12 @@ report_lines.append(line())
 report_lines.append("BƯỚC 3: ƯỚC LƯỢNG KHOẢNG TIN CẬY 95%")
 report_lines.append(line())
 
-n = len(hours)
+# Khoảng tin cậy và kiểm định cho cột giờ ngủ (cùng 1 lượt tính)
+summary = summarize(work, ['hours_numeric'], mu0=MU0, alpha=ALPHA).iloc[0]
+n = summary['n']
 if n >= 2 and not np.isnan(s):
-    tcrit = stats.t.ppf(1 - ALPHA/2, df=n-1)
-    se = s / np.sqrt(n)
-    ci_low = xbar - tcrit * se
-    ci_high = xbar + tcrit * se
-    report_lines.append(f"n = {n}, α = {ALPHA:.2f}, t* = {tcrit:.3f}")
-    report_lines.append(f"Khoảng tin cậy 95% cho trung bình: [{ci_low:.3f}, {ci_high:.3f}]")
+    report_lines.append(f"n = {n}, α = {ALPHA:.2f}, t* = {summary['t_crit']:.3f}")
+    report_lines.append(f"Khoảng tin cậy 95% cho trung bình: [{summary['ci_low']:.3f}, {summary['ci_high']:.3f}]")
 else:
     report_lines.append("Không đủ dữ liệu để tính khoảng tin cậy.")
 
@@ -129,7 +96,7 @@ report_lines.append(line())
 report_lines.append(f"H0: μ = {MU0} giờ   vs   H1: μ ≠ {MU0} giờ")
 
 if n >= 2 and not np.isnan(s):
-    tstat, pval = stats.ttest_1samp(hours, popmean=MU0, alternative="two-sided")
+    tstat, pval = summary['t'], summary['p_value']
     decision = "BÁC BỎ H0" if pval < ALPHA else "CHƯA ĐỦ BẰNG CHỨNG ĐỂ BÁC BỎ H0"
     report_lines.append(f"t = {tstat:.4f}")
     report_lines.append(f"p-value = {pval:.4f}")
@@ -141,6 +108,20 @@ if n >= 2 and not np.isnan(s):
 else:
     report_lines.append("Không đủ dữ liệu để thực hiện kiểm định.")
 
+# Theo từng năm học: mọi cột số, khoảng tin cậy t + bootstrap và kiểm định với MU0
+report_lines.append("")
+report_lines.append(line())
+report_lines.append("BƯỚC 5: THEO NĂM HỌC (khoảng tin cậy t, bootstrap và t-test)")
+report_lines.append(line())
+if YEAR_COL in work.columns:
+    value_cols = ['hours_numeric']
+    by_year = summarize(work, value_cols, by=YEAR_COL, mu0=MU0, alpha=ALPHA)
+    by_year = by_year.join(bootstrap_ci(work, value_cols, by=YEAR_COL, alpha=ALPHA))
+    report_lines.extend(format_report(
+        by_year[['n', 'mean', 'std', 'ci_low', 'ci_high', 'boot_low', 'boot_high', 't', 'p_value']]))
+else:
+    report_lines.append("Không có cột năm học.")
+
 # Xuất kết quả
 report = "\n".join(report_lines)
 print(report)
@@ -0,0 +1,58 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+NUMBER = r"(\d+(?:\.\d+)?)"
+
+# Bộ quy tắc cho câu trả lời dạng khoảng ("5-6 hours", "less than 4", "8+", "7"),
+# biên dịch sẵn và xét theo thứ tự: quy tắc đầu tiên khớp sẽ quyết định giá trị
+RANGE_RULES = [
+    # "a-b" -> trung điểm
+    (re.compile(NUMBER + r"\s*-\s*" + NUMBER),
+     lambda m: (float(m.group(1)) + float(m.group(2))) / 2.0),
+    # "less than x" -> x - 0.5 (không âm)
+    (re.compile(r"\b(less than|under|<)\s*" + NUMBER + r"\b"),
+     lambda m: max(0.0, float(m.group(2)) - 0.5)),
+    # "more than x" -> x + 0.5
+    (re.compile(r"\b(more than|over|above|>)\s*" + NUMBER + r"\b"),
+     lambda m: float(m.group(2)) + 0.5),
+    # "x+" -> x + 0.5
+    (re.compile(r"\b" + NUMBER + r"\s*\+\b"),
+     lambda m: float(m.group(1)) + 0.5),
+    # số đơn lẻ
+    (re.compile(r"\b" + NUMBER + r"\b"),
+     lambda m: float(m.group(1))),
+]
+
+UNIT_PATTERN = re.compile(r"\bhours?\b")
+
+
+# Chuẩn hóa câu trả lời: chữ thường, gạch ngang thống nhất, bỏ đơn vị
+def normalize_answer(s, unit_pattern=UNIT_PATTERN):
+    text = str(s).strip().lower()
+    text = text.replace("–", "-").replace("—", "-")
+    if unit_pattern is not None:
+        text = unit_pattern.sub("", text).strip()
+    return text
+
+
+# Chuyển 1 câu trả lời sang số theo bộ quy tắc (NaN nếu không quy tắc nào khớp)
+def parse_answer(s, rules=RANGE_RULES, unit_pattern=UNIT_PATTERN):
+    if pd.isna(s):
+        return np.nan
+    text = normalize_answer(s, unit_pattern)
+    for pattern, convert in rules:
+        m = pattern.search(text)
+        if m:
+            return convert(m)
+    return np.nan
+
+
+# Chuyển cả cột câu trả lời sang số: chỉ phân tích các câu trả lời khác nhau
+# rồi ánh xạ ngược về từng dòng qua mã category
+def parse_column(series, rules=RANGE_RULES, unit_pattern=UNIT_PATTERN):
+    cat = series.astype("category")
+    values = np.array([parse_answer(c, rules, unit_pattern) for c in cat.cat.categories]
+                      + [np.nan], dtype="float64")  # mã -1 (NaN) -> phần tử cuối
+    return pd.Series(values[cat.cat.codes.to_numpy()], index=series.index, name=series.name)
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+ALL_GROUP = "Tất cả"
+
+
+# Số mẫu, trung bình, phương sai (ddof=1) của từng (nhóm, cột) trong 1 lượt groupby
+def _group_moments(df, value_cols, by):
+    if by is None:
+        data = df[value_cols]
+        count, mean, var = [s.to_frame(ALL_GROUP).T for s in (data.count(), data.mean(), data.var())]
+    else:
+        grouped = df.groupby(by, observed=True)[value_cols]
+        count, mean, var = grouped.count(), grouped.mean(), grouped.var()
+    index = pd.MultiIndex.from_product([count.index, value_cols], names=["group", "column"])
+    return index, (count.to_numpy(dtype="float64").ravel(),
+                   mean.to_numpy(dtype="float64").ravel(),
+                   var.to_numpy(dtype="float64").ravel())
+
+
+# Khoảng tin cậy t và kiểm định t 1 mẫu (H0: μ = mu0, 2 phía) cho mọi cột x nhóm cùng lúc
+# mu0: 1 số cho mọi cột hoặc dict {cột: mu0}; cột không có trong dict chỉ tính khoảng tin cậy
+def summarize(df, value_cols, by=None, mu0=None, alpha=0.05):
+    value_cols = list(value_cols)
+    index, (n, mean, var) = _group_moments(df, value_cols, by)
+    if isinstance(mu0, dict):
+        mu = np.array([mu0.get(c, np.nan) for c in value_cols], dtype="float64")
+    else:
+        mu = np.full(len(value_cols), np.nan if mu0 is None else mu0, dtype="float64")
+    mu = np.tile(mu, len(n) // len(value_cols))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        se = np.sqrt(var / n)
+        dof = np.where(n >= 2, n - 1, np.nan)
+        t_crit = stats.t.ppf(1 - alpha / 2, dof)
+        t_stat = (mean - mu) / se
+        p_value = 2 * stats.t.sf(np.abs(t_stat), dof)
+
+    return pd.DataFrame({
+        "n": n.astype(np.int64),
+        "mean": mean,
+        "std": np.sqrt(var),
+        "se": se,
+        "t_crit": t_crit,
+        "ci_low": mean - t_crit * se,
+        "ci_high": mean + t_crit * se,
+        "mu0": mu,
+        "t": t_stat,
+        "p_value": p_value,
+        "reject": p_value < alpha,
+    }, index=index)
+
+
+# Khoảng tin cậy bootstrap (phân vị) của trung bình cho mọi cột x nhóm
+# Mỗi (nhóm, cột) lấy n_boot mẫu lặp cùng lúc bằng 1 ma trận chỉ số, chia lô để giới hạn bộ nhớ
+def bootstrap_ci(df, value_cols, by=None, n_boot=2000, alpha=0.05, seed=42,
+                 max_cells=10_000_000):
+    value_cols = list(value_cols)
+    rng = np.random.default_rng(seed)
+    groups = [(ALL_GROUP, df)] if by is None else df.groupby(by, observed=True)
+    rows = []
+    index = []
+    for name, part in groups:
+        for col in value_cols:
+            values = part[col].to_numpy(dtype="float64", na_value=np.nan)
+            values = values[~np.isnan(values)]
+            index.append((name, col))
+            if len(values) < 2:
+                rows.append((np.nan, np.nan))
+                continue
+            batch = max(1, max_cells // len(values))
+            means = np.concatenate([
+                values[rng.integers(0, len(values), size=(min(batch, n_boot - start), len(values)))]
+                .mean(axis=1)
+                for start in range(0, n_boot, batch)
+            ])
+            rows.append(tuple(np.quantile(means, [alpha / 2, 1 - alpha / 2])))
+    return pd.DataFrame(rows, columns=["boot_low", "boot_high"],
+                        index=pd.MultiIndex.from_tuples(index, names=["group", "column"]))
+
+
+# Bảng báo cáo dạng chữ (mỗi dòng 1 (nhóm, cột))
+def format_report(table, float_format="{:.4f}".format):
+    return table.to_string(float_format=float_format).split("\n")
@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import crawl
+import storage
+
+# Các kịch bản đo: cấu hình gateway giả lập + cấu hình crawl cần ghi đè
+SCENARIOS = [
+    ("batch_fixed", {}, {"pipeline_mode": False, "adaptive_rate": False, "pause_time": 1}),
+    ("pipeline_fixed", {}, {"pipeline_mode": True, "adaptive_rate": False}),
+    ("pipeline_adaptive", {}, {"pipeline_mode": True, "adaptive_rate": True, "max_rate": 500}),
+    ("pipeline_adaptive_429", {"throttle_rate": 0.01, "error_rate": 0.02},
+     {"pipeline_mode": True, "adaptive_rate": True, "max_rate": 500}),
+]
+
+# Các biến cấu hình của crawl.py mà benchmark thay đổi (để khôi phục sau mỗi kịch bản)
+PATCHED = ["url_list", "url_detail", "output_folder", "state_path",
+           "cache_path", "dedup_path", "dedup", "use_cache", "resume", "max_ads", "shards",
+           "pipeline_mode", "adaptive_rate", "pause_time", "max_rate"]
+
+
+# Chạy gateway giả lập ở tiến trình riêng (CLI của mock_gateway.py) để server không tranh
+# CPU / event loop với crawler và bộ nhớ đo được chỉ là của crawler
+@contextlib.asynccontextmanager
+async def gateway_process(n_ads, latency_ms, **gateway_kwargs):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_gateway.py")
+    args = [sys.executable, script, "--port", "0", "--ads", str(n_ads),
+            "--latency-ms", str(latency_ms)]
+    for k, v in gateway_kwargs.items():
+        args += ["--" + k.replace("_", "-"), str(v)]
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, env=dict(os.environ, PYTHONIOENCODING="utf-8"))
+    try:
+        # dòng đầu tiên gateway in ra: "Mock gateway chạy tại: <url>"
+        line = (await proc.stdout.readline()).decode("utf-8").strip()
+        if not line:
+            raise RuntimeError("Mock gateway không khởi động được")
+        yield line.rsplit(" ", 1)[-1]
+    finally:
+        proc.terminate()
+        await proc.wait()
+
+
+# Đo thời gian / độ trễ ở 1 lượt chạy không có tracemalloc (tracemalloc làm crawler chậm đi
+# đáng kể khi nhiều request song song), bộ nhớ đỉnh đo ở 1 lượt chạy riêng
+async def run_scenario(name, gateway_kwargs, crawl_kwargs, n_ads, latency_ms, memory=True):
+    async with gateway_process(n_ads, latency_ms, **gateway_kwargs) as base_url:
+        result = await crawl_scenario(name, base_url, crawl_kwargs, n_ads)
+        if memory:
+            traced = await crawl_scenario(name, base_url, crawl_kwargs, n_ads, trace=True)
+            result["peak_mem_mb"] = traced["peak_mem_mb"]
+    return result
+
+
+async def crawl_scenario(name, base_url, crawl_kwargs, n_ads, trace=False):
+    saved = {k: getattr(crawl, k) for k in PATCHED}
+    saved_data_folder = storage.data_folder
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = {
+            "url_list": base_url,
+            "url_detail": base_url + "/{}",
+            "output_folder": tmp,
+            "state_path": tmp + "/crawl_state.sqlite",
+            "cache_path": tmp + "/http_cache.sqlite",
+            "dedup_path": tmp + "/dedup_index.sqlite",
+            "dedup": False,  # tin giả có thể trùng nhau, không để bỏ trùng làm lệch số tin
+            "use_cache": False,
+            "resume": False,
+            "max_ads": n_ads,
+            "shards": [(2010, 12000)],
+        }
+        settings.update(crawl_kwargs)
+        try:
+            for k, v in settings.items():
+                setattr(crawl, k, v)
+            storage.data_folder = tmp
+            if trace:
+                tracemalloc.start()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):  # tắt log của crawl
+                await crawl.main()
+            elapsed = time.perf_counter() - start
+            peak = None
+            if trace:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            n_records = len(storage.load_table(crawl.output_table, columns=["Giá"]))
+        finally:
+            for k, v in saved.items():
+                setattr(crawl, k, v)
+            storage.data_folder = saved_data_folder
+
+    lat = np.array(crawl.stats["latencies"]) * 1000
+    p50, p95, p99 = np.percentile(lat, [50, 95, 99]) if len(lat) else (np.nan,) * 3
+    return {
+        "scenario": name,
+        "ads": n_records,
+        "seconds": round(elapsed, 3),
+        "ads_per_sec": round(n_records / elapsed, 1),
+        "requests": crawl.stats["requests"],
+        "errors": crawl.stats["errors"],
+        "retries": crawl.stats["retries"],
+        "p50_ms": round(float(p50), 1),
+        "p95_ms": round(float(p95), 1),
+        "p99_ms": round(float(p99), 1),
+        "peak_mem_mb": None if peak is None else round(peak / 1024 / 1024, 2),
+    }
+
+
+async def main(args):
+    results = []
+    for name, gateway_kwargs, crawl_kwargs in SCENARIOS:
+        if args.only and name not in args.only:
+            continue
+        res = await run_scenario(name, gateway_kwargs, crawl_kwargs, args.ads, args.latency_ms,
+                                 memory=not args.no_memory)
+        results.append(res)
+        print(f"{res['scenario']:<24} {res['ads']:>6} tin  {res['ads_per_sec']:>8} tin/s  "
+              f"p50={res['p50_ms']}ms p95={res['p95_ms']}ms p99={res['p99_ms']}ms  "
+              f"retries={res['retries']}  peak={res['peak_mem_mb']}MB")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print("Đã lưu kết quả:", args.json)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark crawl.py với gateway giả lập")
+    parser.add_argument("--ads", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--only", nargs="*", help="chỉ chạy các kịch bản này")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="không chạy thêm lượt đo bộ nhớ đỉnh (tracemalloc)")
+    asyncio.run(main(parser.parse_args()))
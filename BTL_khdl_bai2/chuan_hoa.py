@@ -1,33 +1,146 @@
-import pandas as pd
+import hashlib
+import os
+
+import joblib
 import numpy as np
+import pandas as pd
 from sklearn.preprocessing import StandardScaler, MinMaxScaler, RobustScaler
-import os
-dir_path = os.path.dirname(__file__)
 
-output_folder = dir_path + os.sep + "data"
-output_path = output_folder + os.sep + "du_lieu_oto_scaled.csv"
-# 1. Đọc dữ liệu gốc
-df = pd.read_csv(output_folder + os.sep + "du_lieu_oto.csv")
+import metrics
+import storage
+from running_stats import Reservoir
+
+input_table = "du_lieu_oto"
+output_table = "du_lieu_oto_scaled"
+state_path = storage.data_folder + os.sep + "scaler_state.joblib"
+
+scaler_mode = "standard"  # "standard" | "minmax" | "robust"
+chunk_size = 100_000      # số dòng xử lý mỗi lần
+full_rescale = False      # True: học lại và chuẩn hóa lại toàn bộ dữ liệu
+
+
+# Trạng thái lưu giữa các lần chạy: scaler đã học, số dòng đã chuẩn hóa,
+# hash của các dòng đó (để phát hiện khi dữ liệu đầu vào bị làm sạch lại từ đầu)
+def new_state(mode, numeric_cols):
+    if mode == "standard":
+        scaler = StandardScaler()
+    elif mode == "minmax":
+        scaler = MinMaxScaler()
+    elif mode == "robust":
+        scaler = RobustScaler()
+    else:
+        raise ValueError(f"Không hỗ trợ kiểu chuẩn hóa: {mode}")
+    return {
+        "mode": mode,
+        "columns": numeric_cols,
+        "scaler": scaler,
+        # RobustScaler không có partial_fit: giữ mẫu reservoir mỗi cột rồi fit lại trên mẫu
+        "samples": {c: Reservoir() for c in numeric_cols} if mode == "robust" else None,
+        "n_rows": 0,
+        "rows_hash": hashlib.sha256().hexdigest(),
+    }
+
+
+def load_state():
+    if os.path.exists(state_path):
+        return joblib.load(state_path)
+    return None
+
+
+def save_state(state):
+    joblib.dump(state, state_path)
+
+
+def row_hashes(chunk):
+    return pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+
+
+# Các dòng mới (chưa chuẩn hóa) của 1 khối
+def new_rows(chunk, offset, n_done):
+    start = max(0, n_done - offset)
+    return chunk.iloc[start:] if start else chunk
+
+
+# Lượt 1: đọc đầu vào 1 lần, vừa tính hash tiền tố vừa cập nhật tham số scaler từ các dòng mới
+# n_rows dòng đầu phải giống lúc đã chuẩn hóa (chỉ nối thêm dòng mới), kiểm tra ngay tại khối
+# chứa dòng cuối của tiền tố, trước khi học từ dòng mới nào
+# Trả về (số dòng mới, tổng số dòng, hash mọi dòng) hoặc None nếu dữ liệu cũ đã đổi
+def fit_new_rows(state):
+    n_done = state["n_rows"]
+    h = hashlib.sha256()
+    offset = 0
+    n_new = 0
+    for chunk in storage.iter_table(input_table, chunk_size=chunk_size):
+        hashes = row_hashes(chunk)
+        if offset < n_done <= offset + len(chunk):
+            h.update(hashes[:n_done - offset].tobytes())
+            if h.hexdigest() != state["rows_hash"]:
+                return None
+            h.update(hashes[n_done - offset:].tobytes())
+        else:
+            h.update(hashes.tobytes())
+        chunk = new_rows(chunk, offset, n_done)
+        offset += len(hashes)
+        values = chunk[state["columns"]].to_numpy(dtype="float64", na_value=np.nan)
+        if not len(values):
+            continue
+        n_new += len(values)
+        if state["samples"] is not None:
+            for i, col in enumerate(state["columns"]):
+                state["samples"][col].update(values[:, i])
+        else:
+            state["scaler"].partial_fit(values)
+    if offset < n_done:
+        return None
+    return n_new, offset, h.hexdigest()
+
+
+def main():
+    # 1. Chọn các cột số cần chuẩn hóa (kiểu số đã cố định theo schema)
+    first = next(storage.iter_table(input_table, chunk_size=1))
+    numeric_cols = first.select_dtypes(include=[np.number]).columns.tolist()
 
-# 2. Chọn các cột số cần chuẩn hóa
-numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
+    # 2. Dùng lại scaler cũ nếu cùng cấu hình và dữ liệu cũ không đổi, ngược lại học lại từ đầu
+    # 3. Lượt 1: cập nhật tham số scaler từ các dòng mới
+    state = None if full_rescale else load_state()
+    result = None
+    if (state is not None and state["mode"] == scaler_mode and state["columns"] == numeric_cols
+            and storage.table_exists(output_table)):
+        result = fit_new_rows(state)
+    if result is None:
+        state = new_state(scaler_mode, numeric_cols)
+        storage.clear_table(output_table)
+        result = fit_new_rows(state)
+    n_new, rows_total, rows_hash = result
+    n_done = state["n_rows"]
+    if n_new == 0:
+        print("Không có dòng mới, giữ nguyên dữ liệu đã chuẩn hóa.")
+        return
+    if state["samples"] is not None:
+        # các cột có số giá trị khác nhau nên fit trên lưới phân vị của từng mẫu
+        # (trung vị và Q1/Q3 của lưới trùng với của mẫu)
+        sample = np.column_stack([
+            np.quantile(state["samples"][c].sample, np.linspace(0, 1, 1001))
+            for c in numeric_cols
+        ])
+        state["scaler"].fit(sample)
 
-# Nếu dữ liệu số nằm trong dạng text (vd: "120,000 km"), thì chuyển đổi:
-for col in ["Năm SX", "Số km đã đi", "Giá"]:  # đổi theo tên cột thật trong file
-    if col in df.columns:
-        df[col] = pd.to_numeric(df[col].astype(str).str.replace(r"[^0-9]", "", regex=True), errors="coerce")
-        if col not in numeric_cols:
-            numeric_cols.append(col)
+    # 4. Lượt 2: chỉ đọc các dòng mới (bỏ qua n_done dòng đã chuẩn hóa), chuẩn hóa và ghi nối
+    for chunk in storage.iter_table(input_table, chunk_size=chunk_size, start=n_done):
+        chunk[numeric_cols] = state["scaler"].transform(
+            chunk[numeric_cols].to_numpy(dtype="float64", na_value=np.nan))
+        storage.append_table(chunk, output_table)
 
-# 3. Chuẩn hóa dữ liệu số
-# Dùng StandardScaler
-scaler = StandardScaler()
-df_scaled = df.copy()
-df_scaled[numeric_cols] = scaler.fit_transform(df[numeric_cols])
+    state["n_rows"] = rows_total
+    state["rows_hash"] = rows_hash
+    save_state(state)
 
-# Nếu muốn thử loại khác thì thay scaler = MinMaxScaler() hoặc RobustScaler()
+    metrics.add_rows(rows_in=n_new, rows_out=n_new)
+    metrics.record(scaler_mode=scaler_mode, rows_total=rows_total)
+    print(f"Đã chuẩn hóa xong {n_new} dòng mới ({scaler_mode}). "
+          f"Dữ liệu mới lưu tại bảng: {output_table}")
 
-# 4. Lưu ra file mới
-df_scaled.to_csv(output_path, index=False, encoding="utf-8-sig")
 
-print("Đã chuẩn hóa xong. File mới lưu tại: du_lieu_oto_scaled.csv")
+if __name__ == "__main__":
+    with metrics.stage("scaling"):
+        main()
@@ -0,0 +1,113 @@
+import multiprocessing
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+
+
+# Chạy K-means: "full" (KMeans đầy đủ) hoặc "minibatch" (MiniBatchKMeans cho dữ liệu lớn)
+# init: tâm cụm ban đầu (warm start từ lần chạy trước), cùng không gian với X
+def fit_kmeans(X, k, mode="full", init=None, batch_size=4096, random_state=42):
+    if init is not None and init.shape != (k, X.shape[1]):
+        init = None  # tâm cũ không khớp số cụm / số cột -> khởi tạo lại
+    kwargs = {"init": init, "n_init": 1} if init is not None else {"n_init": "auto"}
+    if mode == "full":
+        model = KMeans(n_clusters=k, random_state=random_state, **kwargs)
+    elif mode == "minibatch":
+        model = MiniBatchKMeans(n_clusters=k, batch_size=batch_size,
+                                random_state=random_state, **kwargs)
+    else:
+        raise ValueError(f"Không hỗ trợ kiểu K-means: {mode}")
+    return model.fit(X)
+
+
+# Chấm điểm 1 giá trị k: inertia trên toàn bộ X, silhouette trên mẫu (chạy trong tiến trình con)
+def score_k(X, k, mode, sample_size, random_state):
+    model = fit_kmeans(X, k, mode=mode, random_state=random_state)
+    rng = np.random.default_rng(random_state)
+    idx = rng.choice(len(X), size=min(sample_size, len(X)), replace=False)
+    sil = silhouette_score(X[idx], model.labels_[idx]) if k > 1 else np.nan
+    return {"k": k, "inertia": float(model.inertia_), "silhouette": float(sil)}
+
+
+# Đánh giá nhiều k song song trên pool tiến trình, dừng khi hết time_budget giây
+# Trả về (k tốt nhất theo silhouette, danh sách kết quả của các k đã chạy xong)
+def select_k(X, k_values, mode="minibatch", sample_size=10_000, n_jobs=None,
+             time_budget=None, random_state=42):
+    k_values = list(k_values)
+    n_jobs = n_jobs or min(len(k_values), os.cpu_count() or 1)
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    results = []
+    skipped = []
+    # thoát khỏi with sẽ terminate() pool: các k chưa xong bị dừng ngay, không chạy quá hạn
+    with multiprocessing.Pool(n_jobs) as pool:
+        jobs = [(k, pool.apply_async(score_k, (X, k, mode, sample_size, random_state)))
+                for k in k_values]
+        for k, job in jobs:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                results.append(job.get(timeout=timeout))
+            except multiprocessing.TimeoutError:
+                skipped.append(k)
+    if skipped:
+        print(f"Hết thời gian: bỏ các giá trị k chưa chạy xong {skipped}")
+    if not results:
+        raise TimeoutError("Không có giá trị k nào chạy xong trong thời gian cho phép")
+    best = max(results, key=lambda r: r["silhouette"])
+    return best["k"], results
+
+
+# Mô hình phân khúc: scaler đã học, tâm cụm (trong không gian đã chuẩn hóa)
+# và tên phân khúc của từng cụm (labels[i] là tên của cụm i)
+def make_model(features, scaler, centroids, labels):
+    return {
+        "features": list(features),
+        "scaler": scaler,
+        "centroids": np.asarray(centroids, dtype="float64"),
+        "labels": np.asarray(labels, dtype=object),
+    }
+
+
+def save_model(path, model):
+    joblib.dump(model, path)
+
+
+# Trả về None nếu chưa có mô hình hoặc mô hình dùng bộ cột khác
+def load_model(path, features=None):
+    if not os.path.exists(path):
+        return None
+    model = joblib.load(path)
+    if features is not None and model["features"] != list(features):
+        return None
+    return model
+
+
+# Tâm cụm theo đơn vị gốc (dùng làm warm start khi scaler của lần chạy mới khác đi)
+def model_centroids(model):
+    return model["scaler"].inverse_transform(model["centroids"])
+
+
+# Gán cụm gần nhất cho nhiều dòng cùng lúc, không học lại mô hình
+# Trả về mảng mã cụm (-1 cho dòng thiếu dữ liệu)
+def assign_clusters(model, df):
+    X = df[model["features"]].to_numpy(dtype="float64", na_value=np.nan)
+    valid = ~np.isnan(X).any(axis=1)
+    result = np.full(len(X), -1, dtype=np.int64)
+    if valid.any():
+        Z = model["scaler"].transform(X[valid])
+        C = model["centroids"]
+        # |z - c|^2 = |z|^2 - 2 z.c + |c|^2, bỏ |z|^2 vì không đổi theo cụm
+        dist = (C * C).sum(axis=1) - 2.0 * (Z @ C.T)
+        result[valid] = dist.argmin(axis=1)
+    return result
+
+
+# Gán tên phân khúc cho nhiều dòng (None cho dòng thiếu dữ liệu)
+def assign(model, df):
+    clusters = assign_clusters(model, df)
+    labels = np.append(model["labels"], None)  # chỉ số -1 -> None
+    return pd.Series(labels[clusters], index=df.index, name="Phân khúc")
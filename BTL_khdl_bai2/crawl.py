@@ -1,14 +1,30 @@
 import aiohttp
 import asyncio
-import pandas as pd
 import datetime
+import json
 import time
 import os
 
+try:
+    import orjson  # tùy chọn: giải mã JSON nhanh hơn json chuẩn
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+import metrics
+from crawl_state import CrawlState, RecordWriter
+from data_cleaning import StreamCleaner
+from dedup import DedupIndex
+from http_cache import CacheMiss, ResponseCache
+from rate_limiter import AdaptiveRateLimiter, FixedRateLimiter, parse_retry_after
+
 dir_path = os.path.dirname(__file__)
 
 output_folder = dir_path + os.sep + "data"
-output_path = output_folder + os.sep + "oto_chitiet.csv"
+output_table = "oto_chitiet"  # bảng dữ liệu thô trong storage (data/oto_chitiet.parquet + .csv)
+state_path = output_folder + os.sep + "crawl_state.sqlite"
+cache_path = output_folder + os.sep + "http_cache.sqlite"
+dedup_path = output_folder + os.sep + "dedup_index.sqlite"
 
 # Cấu hình
 url_list = "https://gateway.chotot.com/v1/public/ad-listing"
@@ -19,84 +35,184 @@ headers = {
                   "Chrome/121.0.0.0 Safari/537.36"
 }
 
-max_ads = 3000     # số tin cần lấy
+max_ads = 3000     # số tin cần lấy (cho mỗi phân mảnh)
 limit = 20         # mỗi lần gọi list API lấy 20 tin
 batch_size = 200   # mỗi batch lấy 200 tin
 pause_time = 5     # nghỉ 5 giây sau mỗi batch
-concurrency = 10   # số request chạy song song tối đa trong 1 batch
+concurrency = 10   # số request chạy song song ban đầu
+pipeline_mode = True  # True: list API đẩy ID qua hàng đợi cho worker lấy chi tiết ngay
+queue_size = 500   # số ID tối đa chờ trong hàng đợi (giới hạn bộ nhớ, tạo áp lực ngược)
+adaptive_rate = True  # True: tự tăng/giảm tốc theo phản hồi của gateway (AIMD)
+initial_rate = 10     # số request/giây ban đầu
+max_rate = 50         # trần số request/giây
+max_concurrency = 50  # trần số request song song
+retries = 5           # số lần thử lại mỗi request
+resume = True         # True: bỏ qua các tin đã lấy ở lần chạy trước (crawl_state.sqlite)
+flush_every = 50      # số tin gom lại trước mỗi lần ghi nối vào oto_chitiet.csv
+use_cache = True      # lưu response vào http_cache.sqlite để dùng lại
+cache_ttl = 24 * 3600       # tuổi tối đa của response chi tiết trong cache (giây)
+cache_ttl_list = 10 * 60    # trang danh sách thay đổi nhanh nên hết hạn sớm hơn
+cache_max_mb = 500          # vượt quá thì xóa bớt response ít dùng nhất
+replay_mode = False   # True: chạy lại toàn bộ từ cache, không gọi mạng
+dedup = True          # True: đánh dấu tin đăng lại của cùng 1 xe (list_id mới, giá / km sửa nhẹ)
+stream_clean = False  # True: làm sạch và nối ngay vào du_lieu_oto mỗi lần ghi (flush_every tin)
+
+# Các phân mảnh (danh mục cg, khu vực region_v2) cần crawl. Các phân mảnh chạy song song,
+# dùng chung 1 bộ điều tốc (ngân sách request toàn cục) và gộp vào cùng 1 file, bỏ trùng theo list_id
+shards = [
+    (2010, 12000),  # ô tô - Hà Nội
+    # (2010, 13000),  # ô tô - TP. Hồ Chí Minh
+]
 
+cache = None  # ResponseCache, được mở trong main()
 
-# Hàm tiện ích: lấy giá trị từ params/parameters
-def get_value(ad_detail, params, parameters, key):
-    for source in [params, parameters]:
+# Thống kê request của lần chạy gần nhất (benchmark / theo dõi), reset trong main()
+stats = {"requests": 0, "retries": 0, "errors": 0, "latencies": []}
+
+# Cột xuất ra -> khóa của chotot (tra trong params/parameters, nếu không có thì trong ad)
+FIELD_SPEC = {
+    "Năm SX": "mfdate",
+    "Xuất xứ": "carorigin",
+    "Địa điểm": "address",
+    "Kiểu dáng": "cartype",
+    "Số km đã đi": "mileage_v2",
+    "Hộp số": "gearbox",
+    "Tình trạng": "condition_ad",
+    "Nhiên liệu": "fuel",
+    "Hãng xe": "carbrand",
+    "Dòng xe": "carmodel",
+}
+
+
+# Dựng map id -> value trong 1 lượt; params được ưu tiên hơn parameters
+def index_params(detail):
+    values = {}
+    for source in (detail.get("params", []), detail.get("parameters", [])):
         for p in source:
-            if p.get("id") == key:
-                return p.get("value", "")
-    return ad_detail.get(key, "")
+            key = p.get("id")
+            if key is not None and key not in values:
+                values[key] = p.get("value", "")
+    return values
+
+
+# Chuyển JSON chi tiết tin thành 1 bản ghi theo FIELD_SPEC
+def parse_detail(detail):
+    ad_detail = detail.get("ad", {})
+    if not ad_detail:
+        raise ValueError("Không có dữ liệu ad")
+
+    # Ngày đăng
+    list_time = ad_detail.get("list_time")
+    ngay_dang = datetime.datetime.fromtimestamp(
+        int(list_time) / 1000
+    ).strftime("%Y-%m-%d") if list_time else ""
+
+    values = index_params(detail)
+    record = {"Ngày đăng": ngay_dang}
+    for col, key in FIELD_SPEC.items():
+        record[col] = values[key] if key in values else ad_detail.get(key, "")
+    record["Giá"] = ad_detail.get("price", 0)
+
+    # Nếu dữ liệu quá thiếu thì thử lại
+    if not record["Năm SX"] and not record["Nhiên liệu"]:
+        raise ValueError("Dữ liệu thiếu")
+
+    return record
+
+
+# Lỗi HTTP kèm mã trạng thái và Retry-After để bộ điều tốc xử lý
+class HTTPStatusError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+# Tạo bộ điều tốc theo cấu hình
+def make_limiter():
+    if adaptive_rate:
+        return AdaptiveRateLimiter(rate=initial_rate, concurrency=concurrency,
+                                   max_rate=max_rate, max_concurrency=max_concurrency)
+    return FixedRateLimiter(concurrency=concurrency)
+
+
+# Gửi 1 request GET qua bộ điều tốc, báo kết quả (độ trễ / lỗi) về cho nó
+# Nếu bật cache thì trả response đã lưu (không tốn lượt của bộ điều tốc)
+async def request_json(session, url, limiter, params=None, ttl=None):
+    if cache is not None:
+        body = cache.get(url, params, ttl=ttl)
+        if body is not None:
+            return json_loads(body)
+        if cache.replay:
+            raise CacheMiss(url)
+
+    async with limiter:
+        start = time.monotonic()
+        stats["requests"] += 1
+        try:
+            async with session.get(url, headers=headers, params=params, timeout=10) as r:
+                if r.status != 200:
+                    stats["errors"] += 1
+                    retry_after = parse_retry_after(r.headers.get("Retry-After"))
+                    limiter.on_error(r.status, retry_after)
+                    raise HTTPStatusError(r.status, retry_after)
+                body = await r.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            stats["errors"] += 1
+            limiter.on_error(None)
+            raise
+        latency = time.monotonic() - start
+        stats["latencies"].append(latency)
+        limiter.on_success(latency)
+        data = json_loads(body)
+        if cache is not None:
+            cache.put(url, params, body)
+        return data
 
 
 # Lấy chi tiết tin
-async def fetch_detail(session, list_id, sem, retries=5):
-    async with sem:  # semaphore để hạn chế số request song song
-        for attempt in range(retries):
+async def fetch_detail(session, list_id, limiter, retries=retries):
+    url = url_detail.format(list_id)
+    for attempt in range(retries):
+        try:
+            detail = await request_json(session, url, limiter)
             try:
-                async with session.get(url_detail.format(list_id), headers=headers, timeout=10) as r:
-                    if r.status != 200:
-                        raise ValueError(f"HTTP {r.status}")
-                    detail = await r.json()
-
-                    ad_detail = detail.get("ad", {})
-                    if not ad_detail:
-                        raise ValueError("Không có dữ liệu ad")
-
-                    params_detail = detail.get("params", [])
-                    parameters = detail.get("parameters", [])
-
-                    # Ngày đăng
-                    list_time = ad_detail.get("list_time")
-                    ngay_dang = datetime.datetime.fromtimestamp(
-                        int(list_time) / 1000
-                    ).strftime("%Y-%m-%d") if list_time else ""
-
-                    record = {
-                        "Ngày đăng": ngay_dang,
-                        "Năm SX": get_value(ad_detail, params_detail, parameters, "mfdate"),
-                        "Xuất xứ": get_value(ad_detail, params_detail, parameters, "carorigin"),
-                        "Địa điểm": get_value(ad_detail, params_detail, parameters, "address"),
-                        "Kiểu dáng": get_value(ad_detail, params_detail, parameters, "cartype"),
-                        "Số km đã đi": get_value(ad_detail, params_detail, parameters, "mileage_v2"),
-                        "Hộp số": get_value(ad_detail, params_detail, parameters, "gearbox"),
-                        "Tình trạng": get_value(ad_detail, params_detail, parameters, "condition_ad"),
-                        "Nhiên liệu": get_value(ad_detail, params_detail, parameters, "fuel"),
-                        "Giá": ad_detail.get("price", 0)
-                    }
-
-                    # Nếu dữ liệu quá thiếu thì thử lại
-                    if not record["Năm SX"] and not record["Nhiên liệu"]:
-                        raise ValueError("Dữ liệu thiếu")
-
-                    return record
-            except Exception as e:
-                print(f"Lỗi khi lấy {list_id} (attempt {attempt+1}): {e}")
-                await asyncio.sleep(1)
-        return None
+                return parse_detail(detail)
+            except ValueError:
+                # Response thiếu dữ liệu: bỏ khỏi cache để lần thử sau gọi lại mạng
+                if cache is not None and not cache.replay:
+                    cache.delete(url)
+                raise
+        except CacheMiss:
+            return None
+        except Exception as e:
+            print(f"Lỗi khi lấy {list_id} (attempt {attempt+1}): {e}")
+            stats["retries"] += 1
+            await asyncio.sleep(limiter.backoff(attempt, getattr(e, "retry_after", None)))
+    return None
 
 
 # Lấy danh sách ID tin
-async def fetch_list(session, offset):
+async def fetch_list(session, offset, limiter, cg=2010, region=12000, retries=retries):
     params = {
         "limit": limit,
         "o": offset,
-        "cg": 2010,          # danh mục ô tô
-        "region_v2": 12000,  # Hà Nội
+        "cg": cg,             # danh mục (2010: ô tô)
+        "region_v2": region,  # khu vực (12000: Hà Nội)
     }
-    async with session.get(url_list, headers=headers, params=params, timeout=10) as r:
-        if r.status != 200:
-            print(f"Lỗi fetch_list offset={offset}, HTTP {r.status}")
+    for attempt in range(retries):
+        try:
+            res = await request_json(session, url_list, limiter, params=params,
+                                     ttl=cache_ttl_list)
+            ads = res.get("ads", [])
+            return [ad["list_id"] for ad in ads]
+        except CacheMiss:
             return []
-        res = await r.json()
-        ads = res.get("ads", [])
-        return [ad["list_id"] for ad in ads]
+        except Exception as e:
+            print(f"Lỗi fetch_list cg={cg} region={region} offset={offset} (attempt {attempt+1}): {e}")
+            stats["retries"] += 1
+            await asyncio.sleep(limiter.backoff(attempt, getattr(e, "retry_after", None)))
+    return []
 
 
 # Hàm chia batch
@@ -105,42 +221,165 @@ def chunks(lst, n):
         yield lst[i:i + n]
 
 
-# Hàm chính
-async def main():
-    async with aiohttp.ClientSession() as session:
-        list_ids = []
+# Producer: lấy từng trang danh sách của 1 phân mảnh và đẩy ID mới vào hàng đợi ngay khi có
+# queued dùng chung giữa các phân mảnh để tin xuất hiện ở nhiều nơi chỉ lấy 1 lần
+async def produce_ids(session, queue, limiter, state, queued, cg, region):
+    total = 0
+    for offset in range(0, max_ads, limit):
+        ids = await fetch_list(session, offset, limiter, cg=cg, region=region)
+        if not ids:
+            break
+        total += len(ids)
+        for lid in state.filter_new([i for i in ids if i not in queued]):
+            if lid in queued:  # phân mảnh khác vừa thêm trong lúc chờ
+                continue
+            queued.add(lid)
+            await queue.put(lid)  # chờ nếu hàng đợi đầy
+        if total >= max_ads:
+            break
+    print(f"Phân mảnh cg={cg} region={region}: {total} ID tin")
+    return total
+
+
+# Consumer: lấy ID từ hàng đợi và tải chi tiết cho tới khi gặp None
+async def detail_worker(session, queue, limiter, writer):
+    while True:
+        lid = await queue.get()
+        try:
+            if lid is None:
+                return
+            record = await fetch_detail(session, lid, limiter)
+            writer.add(lid, record)
+            if record and writer.written and writer.written % batch_size == 0:
+                print(f"Đã lưu {writer.written} tin")
+        finally:
+            queue.task_done()
+
+
+# Chạy producer của mọi phân mảnh, xong thì gửi None cho từng worker để chúng dừng
+async def produce_all(session, queue, limiter, state, queued, n_workers):
+    totals = await asyncio.gather(*[
+        produce_ids(session, queue, limiter, state, queued, cg, region)
+        for cg, region in shards
+    ])
+    print(f"Thu được {sum(totals)} ID tin, {len(queued)} tin chưa lấy")
+    for _ in range(n_workers):
+        await queue.put(None)
 
-        # Lấy danh sách ID
+
+# Chế độ pipeline: list và detail chạy song song, không có rào chắn theo batch
+async def crawl_pipeline(session, state, writer):
+    queue = asyncio.Queue(maxsize=queue_size)
+    limiter = make_limiter()
+
+    # Đủ worker cho mức song song cao nhất; bộ điều tốc quyết định số request thực chạy
+    n_workers = max_concurrency if adaptive_rate else concurrency
+    workers = [
+        asyncio.create_task(detail_worker(session, queue, limiter, writer))
+        for _ in range(n_workers)
+    ]
+    producer = asyncio.create_task(
+        produce_all(session, queue, limiter, state, set(), n_workers))
+    tasks = [producer, *workers]
+    try:
+        # Worker chết (vd. lỗi ghi đĩa trong writer.add) thì không còn ai lấy hàng đợi,
+        # producer sẽ chờ mãi ở queue.put -> dừng ngay khi có task lỗi và ném lại lỗi đó
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Chế độ cũ: lấy hết ID rồi tải chi tiết theo từng batch
+async def crawl_batches(session, state, writer):
+    limiter = make_limiter()
+    list_ids = []
+
+    # Lấy danh sách ID của từng phân mảnh
+    for cg, region in shards:
+        shard_ids = []
         for offset in range(0, max_ads, limit):
-            ids = await fetch_list(session, offset)
+            ids = await fetch_list(session, offset, limiter, cg=cg, region=region)
             if not ids:
                 break
-            list_ids.extend(ids)
-            if len(list_ids) >= max_ads:
+            shard_ids.extend(ids)
+            if len(shard_ids) >= max_ads:
                 break
+        list_ids.extend(shard_ids)
+
+    total = len(list_ids)
+    list_ids = state.filter_new(list(dict.fromkeys(list_ids)))
+    print(f"Thu được {total} ID tin, {len(list_ids)} tin chưa lấy")
 
-        print(f"Thu được {len(list_ids)} ID tin")
+    for batch_num, batch in enumerate(chunks(list_ids, batch_size), 1):
+        print(f"Đang xử lý batch {batch_num} ({len(batch)} tin)...")
 
-        records = []
-        sem = asyncio.Semaphore(concurrency)
+        tasks = [fetch_detail(session, lid, limiter) for lid in batch]
+        results = await asyncio.gather(*tasks)
 
-        for batch_num, batch in enumerate(chunks(list_ids, batch_size), 1):
-            print(f"Đang xử lý batch {batch_num} ({len(batch)} tin)...")
+        for lid, record in zip(batch, results):
+            writer.add(lid, record)
+        writer.flush()
 
-            tasks = [fetch_detail(session, lid, sem) for lid in batch]
-            results = await asyncio.gather(*tasks)
+        print(f"Hoàn thành batch {batch_num}, tổng cộng {writer.written} tin")
+        await asyncio.sleep(pause_time)  # nghỉ sau mỗi batch
 
-            records.extend([r for r in results if r])
 
-            print(f"Hoàn thành batch {batch_num}, tổng cộng {len(records)} tin")
-            await asyncio.sleep(pause_time)  # nghỉ sau mỗi batch
+# Hàm chính
+async def main():
+    global cache
+    os.makedirs(output_folder, exist_ok=True)
+    stats.update(requests=0, retries=0, errors=0, latencies=[])
+    if use_cache or replay_mode:
+        cache = ResponseCache(cache_path, ttl=cache_ttl,
+                              max_bytes=cache_max_mb * 1024 * 1024, replay=replay_mode)
+    state = CrawlState(state_path)
+    # Chỉ nối tiếp khi state đã có dữ liệu, ngược lại crawl lại từ đầu
+    # (replay luôn dựng lại file từ cache)
+    append = resume and not replay_mode and state.count() > 0
+    if not append:
+        state.reset()
+    dedup_index = DedupIndex(dedup_path) if dedup else None
+    cleaner = StreamCleaner() if stream_clean else None
+    writer = RecordWriter(output_table, state, flush_every=flush_every, append=append,
+                          dedup=dedup_index, cleaner=cleaner)
 
-        df = pd.DataFrame(records).drop_duplicates()
-        df.to_csv(output_path, index=False, encoding="utf-8-sig")
-        print(f"Đã lưu {len(df)} tin vào oto_chitiet.csv")
+    try:
+        async with aiohttp.ClientSession() as session:
+            if pipeline_mode:
+                await crawl_pipeline(session, state, writer)
+            else:
+                await crawl_batches(session, state, writer)
+    finally:
+        writer.close()
+        print(f"Đã lưu thêm {writer.written} tin vào {output_table} "
+              f"(tổng cộng {state.count()} tin)")
+        if dedup_index is not None:
+            print(f"Đánh dấu {writer.duplicates} tin nghi đăng lại (cột dup_of)")
+            dedup_index.close()
+        if cleaner is not None:
+            print(f"Streaming: đã làm sạch và lưu {cleaner.kept} tin vào du_lieu_oto")
+            if writer.clean_errors:
+                print(f"Streaming: {writer.clean_errors} tin lỗi khi làm sạch, "
+                      f"chạy data_cleaning.py để làm sạch lại")
+            metrics.record(stream_clean_kept=cleaner.kept, stream_clean_errors=writer.clean_errors)
+        metrics.add_rows(rows_out=writer.written)
+        metrics.record(suspected_reposts=writer.duplicates)
+        metrics.record(requests=stats["requests"], retries=stats["retries"],
+                       errors=stats["errors"], latency=metrics.latency_histogram(stats["latencies"]))
+        state.close()
+        if cache is not None:
+            print(f"Cache: {cache.hits} hit, {cache.misses} miss")
+            metrics.record(cache_hits=cache.hits, cache_misses=cache.misses)
+            cache.close()
+            cache = None
 
 
 if __name__ == "__main__":
     start = time.time()
-    asyncio.run(main())
+    with metrics.stage("crawl"):
+        asyncio.run(main())
     print("Thời gian chạy:", round(time.time() - start, 2), "giây")
@@ -0,0 +1,117 @@
+import datetime
+import sqlite3
+
+import pandas as pd
+
+import storage
+
+
+# Trạng thái crawl lưu trên đĩa: bảng list_id đã lấy kèm thời điểm lấy
+# ok = 1: đã ghi bản ghi ra file, ok = 0: lấy thất bại (sẽ thử lại ở lần chạy sau)
+class CrawlState:
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen ("
+            " list_id INTEGER PRIMARY KEY,"
+            " fetched_at TEXT NOT NULL,"
+            " ok INTEGER NOT NULL)"
+        )
+        self.conn.commit()
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM seen WHERE ok = 1").fetchone()[0]
+
+    def reset(self):
+        self.conn.execute("DELETE FROM seen")
+        self.conn.commit()
+
+    # Trả về các ID chưa lấy thành công, giữ nguyên thứ tự
+    def filter_new(self, list_ids):
+        if not list_ids:
+            return []
+        placeholders = ",".join("?" * len(list_ids))
+        rows = self.conn.execute(
+            f"SELECT list_id FROM seen WHERE ok = 1 AND list_id IN ({placeholders})",
+            list(list_ids),
+        ).fetchall()
+        done = {r[0] for r in rows}
+        return [lid for lid in list_ids if lid not in done]
+
+    def mark(self, list_ids, ok=True):
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO seen (list_id, fetched_at, ok) VALUES (?, ?, ?)",
+            [(lid, now, int(ok)) for lid in list_ids],
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+# Ghi bản ghi vào bảng (storage) theo từng lô nhỏ ngay khi có, rồi mới đánh dấu ID vào state
+# dedup (DedupIndex, tùy chọn): tin nghi đăng lại của xe đã có vẫn được ghi, kèm list_id của tin
+# gốc trong cột "dup_of" để bước làm sạch quyết định (bỏ nhầm ở đây thì không lấy lại được)
+# cleaner (data_cleaning.StreamCleaner, tùy chọn): mỗi lô ghi ra cũng được làm sạch và nối ngay
+# vào bảng đã làm sạch
+class RecordWriter:
+    def __init__(self, table, state, flush_every=50, append=True, dedup=None, cleaner=None):
+        self.table = table
+        self.state = state
+        self.flush_every = flush_every
+        self.dedup = dedup
+        self.cleaner = cleaner
+        self.written = 0
+        self.duplicates = 0
+        self.clean_errors = 0  # số tin không làm sạch được ở chế độ streaming
+        self._records = []
+        self._ids = []
+        self._failed = []
+        if not append:
+            storage.clear_table(table)
+            if dedup is not None:
+                dedup.reset()
+            if cleaner is not None:
+                cleaner.reset()
+
+    def add(self, list_id, record):
+        if record is None:
+            self._failed.append(list_id)
+        else:
+            dup_of = None if self.dedup is None else self.dedup.check_and_add(list_id, record)
+            if dup_of is not None:
+                record = dict(record, dup_of=dup_of)
+                self.duplicates += 1
+            self._ids.append(list_id)
+            self._records.append(record)
+        if len(self._records) + len(self._failed) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._records:
+            storage.append_table(pd.DataFrame(self._records), self.table)
+            storage.compact_table(self.table)
+            # đánh dấu ngay khi bản ghi thô đã ghi xong: lỗi ở bước làm sạch phía sau
+            # không làm các tin này bị lấy và ghi lại lần nữa ở lần chạy sau
+            self.state.mark(self._ids, ok=True)
+            self.written += len(self._records)
+        if self._failed:
+            self.state.mark(self._failed, ok=False)
+        if self.dedup is not None:
+            self.dedup.commit()
+        if self.cleaner is not None and self._records:
+            try:
+                self.cleaner.add_batch(self._records)
+            except Exception as e:
+                # dữ liệu thô vẫn còn: chạy data_cleaning.py để làm sạch lại toàn bộ
+                self.clean_errors += len(self._records)
+                print(f"Lỗi khi làm sạch {len(self._records)} tin (streaming): {e}")
+        self._records, self._ids, self._failed = [], [], []
+
+    def close(self):
+        self.flush()
+        storage.compact_table(self.table)
+        if self.cleaner is not None:
+            self.cleaner.close()
@@ -1,62 +1,214 @@
-import pandas as pd
 import os
+import re
 
-dir_path = os.path.dirname(__file__)
-
-output_folder = dir_path + os.sep + "data"
-output_path = output_folder + os.sep + "du_lieu_oto.csv"
-
-# Đọc dữ liệu gốc
-df = pd.read_csv( output_folder + os.sep + "oto_chitiet.csv")
-
-# ===== Xử lý dữ liệu thiếu =====
-# Nếu "Tình trạng" là "Mới" và "Số km đã đi" rỗng thì gán 0
-df.loc[df["Tình trạng"].eq("Mới") & df["Số km đã đi"].isna(), "Số km đã đi"] = "0 km"
-
-# Thay NaN trong "Kiểu dáng" thành "Unknown"
-df["Kiểu dáng"] = df["Kiểu dáng"].fillna("Unknown")
-
-# Lấy phần số trong cột "Năm SX" và chuyển sang numeric
-df["Năm SX"] = df["Năm SX"].astype(str).str.extract(r"(\d+)")
-df["Năm SX"] = pd.to_numeric(df["Năm SX"], errors="coerce")
-
-# Chuẩn hóa "Số km đã đi" -> bỏ chữ "km", giữ số
-df["Số km đã đi"] = df["Số km đã đi"].astype(str).str.replace(" km", "", regex=False)
-df["Số km đã đi"] = pd.to_numeric(df["Số km đã đi"], errors="coerce")
-
-# Chuẩn hóa cột "Giá" -> bỏ ký tự không phải số
-df["Giá"] = df["Giá"].astype(str).str.replace(r"[^0-9]", "", regex=True)
-df["Giá"] = pd.to_numeric(df["Giá"], errors="coerce")
-
-# ===== Lọc ngoại lai theo quy tắc 3 sigma =====
-initial_rows = len(df)
-
-# --- Cho Năm SX ---
-mean_year = df["Năm SX"].mean()
-std_year = df["Năm SX"].std()
-lower_year, upper_year = mean_year - 3*std_year, mean_year + 3*std_year
-
-df = df[(df["Năm SX"] >= lower_year) & (df["Năm SX"] <= upper_year)]
-after_year_rows = len(df)
-print("Số hàng bị xoá do ngoại lai ở Năm SX:", initial_rows - after_year_rows)
-
-# --- Cho Số km đã đi ---
-mean_km = df["Số km đã đi"].mean()
-std_km = df["Số km đã đi"].std()
-lower_km, upper_km = mean_km - 3*std_km, mean_km + 3*std_km
-
-df = df[(df["Số km đã đi"] >= lower_km) & (df["Số km đã đi"] <= upper_km)]
-after_km_rows = len(df)
-print("Số hàng bị xoá do ngoại lai ở Số km đã đi:", after_year_rows - after_km_rows)
-
-# --- Cho Giá ---
-mean_price = df["Giá"].mean()
-std_price = df["Giá"].std()
-lower_price, upper_price = mean_price - 3*std_price, mean_price + 3*std_price
-
-df = df[(df["Giá"] >= lower_price) & (df["Giá"] <= upper_price)]
-after_price_rows = len(df)
-print("Số hàng bị xoá do ngoại lai ở Giá:", after_km_rows - after_price_rows)
+import joblib
+import numpy as np
+import pandas as pd
 
-# ===== Xuất dữ liệu đã xử lý =====
-df.to_csv(output_path, index=False, header=True, encoding="utf-8-sig")
+import metrics
+import storage
+from running_stats import Reservoir, RunningStats
+
+input_table = "oto_chitiet"
+output_table = "du_lieu_oto"
+
+chunk_size = 100_000  # số dòng đọc mỗi lần (bộ nhớ không phụ thuộc kích thước file)
+outlier_rule = "sigma"  # "sigma": mean ± 3*std, "mad": median ± 3*MAD, "iqr": Q1 - 1.5*IQR .. Q3 + 1.5*IQR
+outlier_cols = ["Năm SX", "Số km đã đi", "Giá"]
+stream_state_path = storage.data_folder + os.sep + "stream_clean_state.joblib"
+stream_min_count = 100  # chế độ streaming: chỉ lọc ngoại lai khi mỗi cột đã có đủ số giá trị này
+drop_reposts = True  # bỏ các tin crawl.py đánh dấu nghi đăng lại (cột dup_of)
+
+
+# ===== Chuẩn hóa 1 khối dữ liệu thô =====
+def clean_chunk(df):
+    # ===== Xử lý dữ liệu thiếu =====
+    # Nếu "Tình trạng" là "Mới" và "Số km đã đi" rỗng thì gán 0
+    df.loc[df["Tình trạng"].eq("Mới") & df["Số km đã đi"].isna(), "Số km đã đi"] = "0 km"
+
+    # Thay NaN trong "Kiểu dáng" thành "Unknown"
+    df["Kiểu dáng"] = df["Kiểu dáng"].fillna("Unknown")
+
+    # Lấy phần số trong cột "Năm SX" và chuyển sang numeric
+    df["Năm SX"] = df["Năm SX"].astype(str).str.extract(r"(\d+)", expand=False)
+    df["Năm SX"] = pd.to_numeric(df["Năm SX"], errors="coerce")
+
+    # Chuẩn hóa "Số km đã đi" -> bỏ chữ "km", giữ số
+    df["Số km đã đi"] = df["Số km đã đi"].astype(str).str.replace(" km", "", regex=False)
+    df["Số km đã đi"] = pd.to_numeric(df["Số km đã đi"], errors="coerce")
+
+    # Chuẩn hóa cột "Giá" -> bỏ ký tự không phải số
+    df["Giá"] = df["Giá"].astype(str).str.replace(r"[^0-9]", "", regex=True)
+    df["Giá"] = pd.to_numeric(df["Giá"], errors="coerce")
+    return df
+
+
+# Tin nghi đăng lại: crawl.py ghi list_id của tin gốc vào "dup_of" (dedup.py)
+# Bỏ các tin đó nếu drop_reposts; cột dup_of không đưa sang bảng đã làm sạch
+# Trả về (khối còn lại, số tin bị bỏ)
+def split_reposts(chunk):
+    if "dup_of" not in chunk.columns:
+        return chunk, 0
+    repost = chunk["dup_of"].notna().to_numpy(dtype=bool)
+    if not drop_reposts:
+        repost[:] = False
+    return chunk[~repost].drop(columns="dup_of"), int(repost.sum())
+
+
+# ===== Chuẩn hóa 1 bản ghi thô (dict từ crawl.parse_detail), cùng quy tắc với clean_chunk =====
+def clean_record(record):
+    # chuỗi rỗng tương đương ô trống khi đọc lại từ CSV
+    row = {k: (None if v == "" or v is None else v) for k, v in record.items()}
+    km = row.get("Số km đã đi")
+    if row.get("Tình trạng") == "Mới" and km is None:
+        km = "0 km"
+    if row.get("Kiểu dáng") is None:
+        row["Kiểu dáng"] = "Unknown"
+    year = re.search(r"\d+", str(row.get("Năm SX")))
+    row["Năm SX"] = float(year.group(0)) if year else np.nan
+    km = str(km).replace(" km", "")
+    row["Số km đã đi"] = float(km) if re.fullmatch(r"\s*-?\d+(\.\d*)?\s*", km) else np.nan
+    digits = re.sub(r"[^0-9]", "", str(row.get("Giá")))
+    row["Giá"] = float(digits) if digits else np.nan
+    return row
+
+
+# ===== Chế độ streaming: nhận từng lô nhỏ bản ghi thô ngay khi crawl được =====
+# Chuẩn hóa, cập nhật thống kê gộp được, lọc ngoại lai theo ngưỡng hiện tại rồi ghi nối vào
+# du_lieu_oto; thống kê lưu giữa các lần chạy để không phải đọc lại dữ liệu cũ
+class StreamCleaner:
+    def __init__(self, rule=outlier_rule, min_count=stream_min_count, state_path=stream_state_path):
+        self.rule = rule
+        self.min_count = min_count
+        self.state_path = state_path
+        self.kept = 0
+        self.dropped = {col: 0 for col in outlier_cols}
+        self.stats = None
+        if os.path.exists(state_path):
+            state = joblib.load(state_path)
+            if state["rule"] == rule:
+                self.stats = state["stats"]
+        if self.stats is None:
+            self.stats = new_stats(rule)
+
+    # Bắt đầu lại từ đầu (crawl lại toàn bộ): xóa bảng kết quả và thống kê
+    def reset(self):
+        self.stats = new_stats(self.rule)
+        storage.clear_table(output_table)
+
+    def add_batch(self, records):
+        if not records:
+            return
+        chunk, reposts = split_reposts(pd.DataFrame([clean_record(r) for r in records]))
+        metrics.add_dropped("stream_repost", reposts)
+        # ép kiểu theo schema trước khi cập nhật thống kê: giá trị vượt phạm vi kiểu thành NA,
+        # không làm lệch thống kê và bị bỏ như dòng thiếu giá trị
+        chunk = storage.apply_schema(chunk, {col: storage.CLEAN_SCHEMA[col] for col in outlier_cols})
+        for col in outlier_cols:
+            self.stats[col].update(chunk[col].to_numpy(dtype="float64", na_value=np.nan))
+        # chưa đủ dữ liệu thì ngưỡng chưa ổn định: chỉ bỏ dòng thiếu giá trị
+        if all(self.stats[col].count >= self.min_count for col in outlier_cols):
+            bounds = outlier_bounds(self.stats, self.rule)
+        else:
+            bounds = {col: (-np.inf, np.inf) for col in outlier_cols}
+        out, dropped = apply_bounds(chunk, bounds)
+        for col, n in dropped.items():
+            self.dropped[col] += n
+            metrics.add_dropped(f"stream_outlier:{col}", n)
+        self.kept += len(out)
+        if len(out):
+            storage.append_table(out, output_table)
+            # mỗi lô là 1 part nhỏ: gộp lại khi đủ compact_min_parts part
+            storage.compact_table(output_table)
+
+    def close(self):
+        joblib.dump({"rule": self.rule, "stats": self.stats}, self.state_path)
+
+
+def new_stats(rule):
+    return {col: Reservoir() if rule in ("mad", "iqr") else RunningStats()
+            for col in outlier_cols}
+
+
+# ===== Lượt 1: gom thống kê gộp được của các cột cần lọc ngoại lai =====
+def collect_stats(rule):
+    stats = new_stats(rule)
+    n_rows = 0
+    for chunk in storage.iter_table(input_table, chunk_size=chunk_size):
+        n_rows += len(chunk)
+        chunk, _ = split_reposts(clean_chunk(chunk))
+        for col in outlier_cols:
+            stats[col].update(chunk[col].to_numpy(dtype="float64", na_value=np.nan))
+    return stats, n_rows
+
+
+# Ngưỡng [dưới, trên] của từng cột theo quy tắc đã chọn
+def outlier_bounds(stats, rule):
+    bounds = {}
+    for col, st in stats.items():
+        if rule == "sigma":
+            lower, upper = st.mean - 3 * st.std, st.mean + 3 * st.std
+        elif rule == "mad":
+            median = st.quantile(0.5)
+            mad = np.median(np.abs(st.sample - median)) * 1.4826  # quy về tương đương std
+            lower, upper = median - 3 * mad, median + 3 * mad
+        elif rule == "iqr":
+            q1, q3 = st.quantile(0.25), st.quantile(0.75)
+            lower, upper = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+        else:
+            raise ValueError(f"Không hỗ trợ quy tắc ngoại lai: {rule}")
+        bounds[col] = (lower, upper)
+    return bounds
+
+
+# 1 mặt nạ chung cho mọi cột; trả về (các dòng giữ lại, số dòng vượt ngưỡng ở từng cột)
+def apply_bounds(chunk, bounds):
+    mask = np.ones(len(chunk), dtype=bool)
+    dropped = {}
+    for col, (lower, upper) in bounds.items():
+        ok = chunk[col].between(lower, upper).to_numpy(dtype=bool, na_value=False)
+        dropped[col] = int((~ok).sum())
+        mask &= ok
+    return chunk[mask], dropped
+
+
+# ===== Lượt 2: chuẩn hóa, áp 1 mặt nạ ngoại lai chung và ghi nối dần ra bảng kết quả =====
+def filter_and_write(bounds):
+    dropped = {col: 0 for col in outlier_cols}
+    kept = 0
+    reposts = 0
+    storage.clear_table(output_table)
+    for chunk in storage.iter_table(input_table, chunk_size=chunk_size):
+        chunk, n_reposts = split_reposts(clean_chunk(chunk))
+        reposts += n_reposts
+        out, chunk_dropped = apply_bounds(chunk, bounds)
+        for col, n in chunk_dropped.items():
+            dropped[col] += n
+        kept += len(out)
+        if len(out):
+            storage.append_table(out, output_table)
+    return kept, dropped, reposts
+
+
+def main():
+    stats, initial_rows = collect_stats(outlier_rule)
+    bounds = outlier_bounds(stats, outlier_rule)
+    kept, dropped, reposts = filter_and_write(bounds)
+    # chế độ streaming của crawl.py nối tiếp từ thống kê của toàn bộ dữ liệu thô này
+    joblib.dump({"rule": outlier_rule, "stats": stats}, stream_state_path)
+
+    print("Số tin nghi đăng lại bị xoá:", reposts)
+    # 1 dòng có thể vượt ngưỡng ở nhiều cột nên tổng các cột có thể lớn hơn số dòng bị xoá
+    for col in outlier_cols:
+        print(f"Số hàng bị xoá do ngoại lai ở {col}:", dropped[col])
+    print(f"Giữ lại {kept}/{initial_rows} hàng (quy tắc: {outlier_rule})")
+    metrics.add_rows(rows_in=initial_rows, rows_out=kept)
+    metrics.add_dropped("repost", reposts)
+    for col in outlier_cols:
+        metrics.add_dropped(f"outlier:{col}", dropped[col])
+    metrics.record(outlier_rule=outlier_rule)
+
+
+if __name__ == "__main__":
+    with metrics.stage("cleaning"):
+        main()
@@ -0,0 +1,105 @@
+import hashlib
+import math
+import re
+import sqlite3
+
+# Các trường xác định 1 chiếc xe (không dùng list_id, ngày đăng vì tin đăng lại sẽ đổi)
+KEY_FIELDS = ["Hãng xe", "Dòng xe", "Kiểu dáng", "Hộp số", "Nhiên liệu", "Xuất xứ", "Địa điểm"]
+
+
+def _digits(value):
+    digits = re.sub(r"[^0-9]", "", str(value))
+    return int(digits) if digits else None
+
+
+def _text(value):
+    return " ".join(str(value).lower().split())
+
+
+# Chỉ mục tin trùng gần đúng: mỗi tin được băm theo các trường chính đã chuẩn hóa,
+# số km và giá được gom vào các ô (km_step km, giá lệch nhau price_tolerance)
+# Khi kiểm tra, dò cả các ô kề bên (multi-probe) để lấy ứng viên bằng vài lượt tra chỉ mục
+# thay vì so với toàn bộ lịch sử, rồi so số km / giá thật của từng ứng viên: chỉ coi là trùng
+# khi lệch không quá km_step km và giá lệch không quá price_tolerance
+class DedupIndex:
+    def __init__(self, path, km_step=5000, price_tolerance=0.05):
+        self.path = path
+        self.km_step = km_step
+        self.price_tolerance = price_tolerance
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("DROP TABLE IF EXISTS fingerprints")  # dạng cũ: chỉ có khóa ô
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS listings ("
+            " list_id INTEGER PRIMARY KEY,"
+            " cell TEXT NOT NULL,"
+            " km INTEGER NOT NULL,"
+            " price INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS listings_cell ON listings (cell)")
+        self.conn.commit()
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+
+    def reset(self):
+        self.conn.execute("DELETE FROM listings")
+        self.conn.commit()
+
+    # (phần cố định, số km, giá) của 1 bản ghi thô; None nếu thiếu năm SX hoặc giá
+    # km = -1 nếu không rõ (tin "Mới" không ghi km coi là 0 km)
+    def parse(self, record):
+        year = _digits(record.get("Năm SX", ""))
+        price = _digits(record.get("Giá", ""))
+        if not year or not price:
+            return None
+        km = _digits(record.get("Số km đã đi", ""))
+        if km is None:
+            km = 0 if record.get("Tình trạng") == "Mới" else -1
+        base = "|".join([str(year)] + [_text(record.get(f, "")) for f in KEY_FIELDS])
+        return base, km, price
+
+    def cells(self, km, price):
+        km_cell = km // self.km_step if km >= 0 else -1
+        price_cell = math.floor(math.log(price) / math.log1p(self.price_tolerance))
+        return km_cell, price_cell
+
+    @staticmethod
+    def _key(base, km_cell, price_cell):
+        return hashlib.sha1(f"{base}|{km_cell}|{price_cell}".encode("utf-8")).hexdigest()
+
+    def similar(self, km, price, other_km, other_price):
+        # km không rõ (-1) chỉ khớp với tin cũng không rõ km
+        if (km < 0) != (other_km < 0) or abs(km - other_km) > self.km_step:
+            return False
+        return max(price, other_price) <= min(price, other_price) * (1 + self.price_tolerance)
+
+    # Trả về list_id của tin đã có gần giống record (None nếu chưa có)
+    # Tin không trùng được thêm vào chỉ mục (tin trùng thì không, tin gốc vẫn là đại diện)
+    def check_and_add(self, list_id, record):
+        parsed = self.parse(record)
+        if parsed is None:
+            return None
+        base, km, price = parsed
+        km_cell, price_cell = self.cells(km, price)
+        km_cells = [-1] if km_cell < 0 else [k for k in (km_cell - 1, km_cell, km_cell + 1) if k >= 0]
+        probes = [self._key(base, k, p)
+                  for k in km_cells
+                  for p in (price_cell - 1, price_cell, price_cell + 1)]
+        placeholders = ",".join("?" * len(probes))
+        rows = self.conn.execute(
+            f"SELECT list_id, km, price FROM listings WHERE cell IN ({placeholders})", probes
+        ).fetchall()
+        for other_id, other_km, other_price in rows:
+            if other_id != list_id and self.similar(km, price, other_km, other_price):
+                return other_id
+        self.conn.execute(
+            "INSERT OR REPLACE INTO listings (list_id, cell, km, price) VALUES (?, ?, ?, ?)",
+            (list_id, self._key(base, km_cell, price_cell), km, price))
+        return None
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,98 @@
+import hashlib
+import sqlite3
+import time
+from urllib.parse import urlencode
+
+
+# Lỗi khi chạy replay mà response chưa có trong cache
+class CacheMiss(Exception):
+    pass
+
+
+# Khóa cache: URL + params đã sắp xếp
+def cache_key(url, params=None):
+    if params:
+        url = url + "?" + urlencode(sorted(params.items()))
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+# Cache response HTTP trên đĩa (SQLite), có TTL và xóa bớt theo dung lượng (LRU)
+# replay=True: bỏ qua TTL, chỉ phục vụ từ cache, không bao giờ gọi mạng
+class ResponseCache:
+    def __init__(self, path, ttl=24 * 3600, max_bytes=500 * 1024 * 1024, replay=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " url TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " body BLOB NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed_at)"
+        )
+        self.conn.commit()
+        self._total = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def get(self, url, params=None, ttl=None):
+        key = cache_key(url, params)
+        row = self.conn.execute(
+            "SELECT fetched_at, body FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        if row is None or (not self.replay and now - row[0] > ttl):
+            self.misses += 1
+            return None
+        self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[1]
+
+    def put(self, url, params, body):
+        key = cache_key(url, params)
+        now = time.time()
+        old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, url, fetched_at, accessed_at, size, body)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (key, url, now, now, len(body), body),
+        )
+        self._total += len(body) - (old[0] if old else 0)
+        if self._total > self.max_bytes:
+            self.evict()
+        self.conn.commit()
+
+    def delete(self, url, params=None):
+        key = cache_key(url, params)
+        row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total -= row[0]
+
+    # Xóa các response ít dùng gần đây nhất cho tới khi dưới 90% dung lượng tối đa
+    def evict(self):
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        )
+        to_delete = []
+        for key, size in rows:
+            if self._total <= target:
+                break
+            to_delete.append((key,))
+            self._total -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
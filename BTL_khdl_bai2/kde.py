@@ -0,0 +1,89 @@
+import numpy as np
+
+STEPS_PER_BW = 8    # lưới nội bộ của binned_kde: ít nhất 8 bước trong 1 bandwidth
+MAX_GRID = 1 << 20  # giới hạn số điểm lưới nội bộ (bộ nhớ / thời gian FFT)
+
+
+# Độ lệch chuẩn và phân vị có trọng số (weights=None -> mọi điểm như nhau)
+def _weighted_std(data, weights):
+    mean = np.average(data, weights=weights)
+    return np.sqrt(np.average((data - mean) ** 2, weights=weights))
+
+
+def _weighted_quantile(data, weights, q):
+    order = np.argsort(data)
+    cum = np.cumsum(weights[order])
+    return np.interp(np.asarray(q) * cum[-1], cum, data[order])
+
+
+# Chọn bandwidth cho kernel Gauss
+# "normal": 1.06 * std * n^-1/5 (quy tắc cũ của plot_graph.py)
+# "silverman": 0.9 * min(std, IQR/1.34) * n^-1/5, ít bị kéo rộng bởi đuôi dài / ngoại lai
+def bandwidth(data, rule="normal", weights=None):
+    data = np.asarray(data, dtype="float64")
+    weights = np.ones_like(data) if weights is None else np.asarray(weights, dtype="float64")
+    # với trọng số dùng cỡ mẫu hiệu dụng (sum w)^2 / sum w^2
+    n = weights.sum() ** 2 / (weights ** 2).sum()
+    std = _weighted_std(data, weights)
+    if rule == "normal":
+        return 1.06 * std * n ** (-1 / 5)
+    if rule == "silverman":
+        q1, q3 = _weighted_quantile(data, weights, [0.25, 0.75])
+        spread = min(std, (q3 - q1) / 1.34) if q3 > q1 else std
+        return 0.9 * spread * n ** (-1 / 5)
+    raise ValueError(f"Không hỗ trợ quy tắc bandwidth: {rule}")
+
+
+# Chia trọng số mỗi điểm cho 2 nút lưới gần nhất theo khoảng cách (linear binning)
+def linear_binning(data, start, delta, size, weights):
+    pos = (data - start) / delta
+    # sai số làm tròn có thể đẩy điểm ở đúng mép lưới (min / max của xs) ra ngoài một chút
+    tol = 1e-6
+    keep = (pos >= -tol) & (pos <= size - 1 + tol)
+    pos, weights = np.clip(pos[keep], 0, size - 1), weights[keep]
+    idx = np.floor(pos).astype(np.int64)
+    frac = pos - idx
+    counts = np.bincount(idx, weights * (1 - frac), minlength=size + 1)
+    counts += np.bincount(idx + 1, weights * frac, minlength=size + 1)
+    return counts[:size]
+
+
+# KDE Gauss tại các điểm lưới cách đều xs: gom dữ liệu vào 1 lưới nội bộ (2^k điểm, bước
+# <= bw / STEPS_PER_BW) rồi tích chập với kernel bằng FFT và nội suy tuyến tính về xs
+# Lưới nội bộ theo bandwidth chứ không theo xs: bandwidth giảm theo n^-1/5 nên với nhiều dữ liệu
+# bước của xs có thể lớn hơn bandwidth, gom thẳng vào xs khi đó sẽ sai
+# Chi phí O(n + m log m) thay vì O(n * len(xs)) như tính trực tiếp từng điểm
+def binned_kde(xs, data, bw=None, rule="normal", weights=None):
+    xs = np.asarray(xs, dtype="float64")
+    data = np.asarray(data, dtype="float64")
+    weights = np.ones_like(data) if weights is None else np.asarray(weights, dtype="float64")
+    keep = ~np.isnan(data) & ~np.isnan(weights)
+    data, weights = data[keep], weights[keep]
+    if len(xs) < 2:
+        raise ValueError("Lưới xs cần ít nhất 2 điểm")
+    delta = xs[1] - xs[0]
+    if delta <= 0 or not np.allclose(np.diff(xs), delta):
+        raise ValueError("Lưới xs phải tăng và cách đều")
+    if not len(data) or weights.sum() <= 0:
+        return np.zeros_like(xs)
+    if bw is None:
+        bw = bandwidth(data, rule, weights)
+    if not bw > 0:
+        return np.full_like(xs, np.nan)
+
+    # lưới nội bộ phủ xs và các điểm dữ liệu cách xs không quá 4 bandwidth
+    # (phần kernel xa hơn 4 bandwidth < 0.04% khối lượng, bỏ qua)
+    lo = min(xs[0], max(xs[0] - 4 * bw, data.min()))
+    hi = max(xs[-1], min(xs[-1] + 4 * bw, data.max()))
+    size = int(np.ceil((hi - lo) * STEPS_PER_BW / bw)) + 1
+    size = min(1 << int(np.ceil(np.log2(max(size, len(xs))))), MAX_GRID)
+    step = (hi - lo) / (size - 1)
+    counts = linear_binning(data, lo, step, size, weights)
+
+    reach = min(int(np.ceil(4 * bw / step)), size - 1)
+    offsets = np.arange(-reach, reach + 1) * step
+    kernel = np.exp(-0.5 * (offsets / bw) ** 2) / (bw * np.sqrt(2 * np.pi))
+    n_fft = 1 << int(np.ceil(np.log2(size + len(kernel) - 1)))
+    conv = np.fft.irfft(np.fft.rfft(counts, n_fft) * np.fft.rfft(kernel, n_fft), n_fft)
+    density = np.maximum(conv[reach:reach + size] / weights.sum(), 0.0)
+    return np.interp(xs, lo + step * np.arange(size), density)
@@ -0,0 +1,139 @@
+import argparse
+import os
+
+import numpy as np
+from aiohttp import web
+
+import clustering
+import location
+import storage
+
+# Tên bộ lọc khoảng -> cột trong du_lieu_oto
+RANGE_COLS = {"year": "Năm SX", "km": "Số km đã đi", "price": "Giá"}
+QUERY_COLUMNS = ["Năm SX", "Số km đã đi", "Giá", "Địa điểm"]
+model_path = storage.data_folder + os.sep + "segment_model.joblib"
+
+
+# Chỉ mục trong bộ nhớ trên bảng đã làm sạch: nạp 1 lần, mỗi cột số giữ (giá trị đã sắp xếp,
+# vị trí dòng) để lọc khoảng bằng tìm kiếm nhị phân; "Khu vực" giữ danh sách dòng theo từng khu vực
+class ListingIndex:
+    def __init__(self, df):
+        self.n_rows = len(df)
+        self.price = df["Giá"].to_numpy(dtype="float64", na_value=np.nan)
+        self.values = {}
+        self.sorted = {}
+        for name, col in RANGE_COLS.items():
+            values = df[col].to_numpy(dtype="float64", na_value=np.nan)
+            order = np.argsort(values, kind="stable")
+            n_valid = int((~np.isnan(values)).sum())  # NaN nằm cuối sau khi sắp xếp
+            self.values[name] = values
+            self.sorted[name] = (values[order[:n_valid]], order[:n_valid])
+        # mã khu vực của từng dòng và danh sách dòng của từng khu vực (xếp theo mã)
+        khu_vuc = location.khuvuc_column(df["Địa điểm"])
+        self.area_codes = khu_vuc.cat.codes.to_numpy()
+        order = np.argsort(self.area_codes, kind="stable")
+        bounds = np.searchsorted(self.area_codes[order], np.arange(len(khu_vuc.cat.categories) + 1))
+        self.areas = {name: order[bounds[i]:bounds[i + 1]]
+                      for i, name in enumerate(khu_vuc.cat.categories)}
+        self.area_index = {name: i for i, name in enumerate(khu_vuc.cat.categories)}
+        self.segments = None
+        model = clustering.load_model(model_path)
+        if model is not None:
+            self.segments = clustering.assign(model, df).to_numpy()
+
+    @classmethod
+    def load(cls, table="du_lieu_oto"):
+        return cls(storage.load_table(table, columns=QUERY_COLUMNS))
+
+    # Các dòng có lo <= giá trị <= hi (None: không giới hạn), lấy từ mảng đã sắp xếp
+    def range_rows(self, name, lo=None, hi=None):
+        values, order = self.sorted[name]
+        start = 0 if lo is None else np.searchsorted(values, lo, side="left")
+        end = len(values) if hi is None else np.searchsorted(values, hi, side="right")
+        return order[start:end]
+
+    # Vị trí các dòng thỏa mọi bộ lọc: bắt đầu từ bộ lọc hẹp nhất, các bộ lọc còn lại
+    # chỉ kiểm tra trên tập ứng viên đó (không quét toàn bảng)
+    # ranges: {"year": (lo, hi), ...}, khu_vuc: tên khu vực hoặc None
+    def rows(self, ranges=None, khu_vuc=None):
+        ranges = {k: v for k, v in (ranges or {}).items() if v != (None, None)}
+        candidates = []
+        for name, (lo, hi) in ranges.items():
+            candidates.append((name, self.range_rows(name, lo, hi)))
+        if khu_vuc is not None:
+            candidates.append(("khu_vuc", self.areas.get(khu_vuc, np.empty(0, dtype=np.int64))))
+        if not candidates:
+            return np.arange(self.n_rows)
+        name, rows = min(candidates, key=lambda c: len(c[1]))
+        for other, (lo, hi) in ranges.items():
+            if other == name or not len(rows):
+                continue
+            v = self.values[other][rows]
+            keep = ~np.isnan(v)
+            if lo is not None:
+                keep &= v >= lo
+            if hi is not None:
+                keep &= v <= hi
+            rows = rows[keep]
+        if khu_vuc is not None and name != "khu_vuc":
+            rows = rows[self.area_codes[rows] == self.area_index.get(khu_vuc, -2)]
+        return np.sort(rows)
+
+    # Thống kê giá của các dòng đã lọc (và phân bố phân khúc nếu có mô hình K-means)
+    def aggregate(self, rows):
+        prices = self.price[rows]
+        prices = prices[~np.isnan(prices)]
+        result = {"count": int(len(rows))}
+        if len(prices):
+            result.update({
+                "price_mean": float(prices.mean()),
+                "price_median": float(np.median(prices)),
+                "price_min": float(prices.min()),
+                "price_max": float(prices.max()),
+                "price_q1": float(np.quantile(prices, 0.25)),
+                "price_q3": float(np.quantile(prices, 0.75)),
+            })
+        if self.segments is not None:
+            labels, counts = np.unique(self.segments[rows].astype(str), return_counts=True)
+            result["segments"] = {l: int(c) for l, c in zip(labels, counts) if l != "None"}
+        return result
+
+    def query(self, ranges=None, khu_vuc=None):
+        return self.aggregate(self.rows(ranges, khu_vuc))
+
+
+# Đọc bộ lọc từ query string: year_min, year_max, km_min, km_max, price_min, price_max, khu_vuc
+def parse_filters(params):
+    ranges = {}
+    for name in RANGE_COLS:
+        lo, hi = params.get(f"{name}_min"), params.get(f"{name}_max")
+        ranges[name] = (None if lo is None else float(lo), None if hi is None else float(hi))
+    return ranges, params.get("khu_vuc")
+
+
+# API cục bộ: GET /query?year_min=2015&year_max=2018&km_max=80000&khu_vuc=Quận Cầu Giấy
+def make_app(index):
+    async def handle_query(request):
+        try:
+            ranges, khu_vuc = parse_filters(request.query)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        return web.json_response(index.query(ranges, khu_vuc))
+
+    async def handle_areas(request):
+        return web.json_response(sorted(index.areas))
+
+    app = web.Application()
+    app.router.add_get("/query", handle_query)
+    app.router.add_get("/areas", handle_areas)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API truy vấn tin đã làm sạch")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--table", default="du_lieu_oto")
+    args = parser.parse_args()
+    index = ListingIndex.load(args.table)
+    print(f"Đã nạp {index.n_rows} tin, {len(index.areas)} khu vực")
+    web.run_app(make_app(index), host="127.0.0.1", port=args.port)
@@ -0,0 +1,31 @@
+import functools
+
+import numpy as np
+import pandas as pd
+
+# Các từ đánh dấu đơn vị hành chính, xét theo thứ tự này
+MARKERS = ["Quận", "Huyện", "Thị xã", "Xã", "Phường"]
+
+
+# Khu vực của 1 địa chỉ: đoạn bắt đầu từ từ đánh dấu đầu tiên có trong chuỗi tới dấu phẩy,
+# nếu không có thì lấy đoạn trước dấu phẩy đầu tiên
+# Có cache vì địa chỉ lặp lại rất nhiều (dùng được khi xử lý từng tin, vd. lúc crawl)
+@functools.lru_cache(maxsize=100_000)
+def parse_khuvuc(dia_diem):
+    for marker in MARKERS:
+        start = dia_diem.find(marker)
+        if start >= 0:
+            return dia_diem[start:].split(",")[0].strip()
+    return dia_diem.split(",")[0].strip()
+
+
+# Cột "Khu vực" (category) cho cả cột "Địa điểm": mỗi địa chỉ khác nhau chỉ phân tích 1 lần
+def khuvuc_column(dia_diem):
+    codes, uniques = pd.factorize(dia_diem)  # NaN -> mã -1
+    parsed = [parse_khuvuc(str(u)) for u in uniques]
+    categories = pd.Index(pd.unique(np.array(parsed, dtype=object)))
+    # mã của địa chỉ -> mã của khu vực
+    unique_codes = categories.get_indexer(parsed)
+    codes = np.where(codes >= 0, unique_codes[codes] if len(parsed) else codes, -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories),
+                     index=dia_diem.index, name="Khu vực")
@@ -0,0 +1,225 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+import storage
+
+try:
+    import resource  # không có trên Windows
+    HAS_RESOURCE = True
+except ImportError:
+    HAS_RESOURCE = False
+
+metrics_folder = storage.data_folder + os.sep + "metrics"
+
+# Bật cProfile cho các bước: biến môi trường PROFILE_STAGES="all" hoặc "cleaning,clustering"
+profile_env = "PROFILE_STAGES"
+profile_top = 20  # số hàm tốn thời gian nhất ghi vào JSON
+
+# Bật tracemalloc cho các bước (cùng cú pháp PROFILE_STAGES): đo cấp phát của Python / numpy /
+# pandas trong tiến trình chính nhưng làm chậm bước đáng kể, nên mặc định tắt
+trace_env = "TRACE_MEMORY"
+
+# Mặc định đo bộ nhớ đỉnh của bước bằng cách lấy mẫu RSS (tiến trình chính + tiến trình con)
+rss_interval = 0.05  # giây giữa 2 lần lấy mẫu
+
+# Biên (ms) của histogram độ trễ request
+latency_buckets_ms = [0, 50, 100, 200, 500, 1000, 2000, 5000, 10000, np.inf]
+
+_run = None    # lần chạy hiện tại: {"name", "started_at", "stages": [...]}
+_stage = None  # bản ghi của bước đang chạy
+
+
+# Bộ nhớ đỉnh của cả tiến trình từ lúc khởi động (không reset được giữa các bước)
+def process_peak_rss_mb():
+    if not HAS_RESOURCE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả KB, macOS trả byte
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# RSS hiện tại (MB) của tiến trình này cộng các tiến trình con trực tiếp (pool vẽ, chọn k...)
+# Trang nhớ dùng chung sau fork bị tính ở cả cha và con. None nếu không có /proc (không phải Linux)
+def tree_rss_mb():
+    try:
+        pids = ["self"]
+        for tid in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{tid}/children") as f:
+                pids += f.read().split()
+        pages = 0
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    pages += int(f.read().split()[1])
+            except OSError:  # tiến trình con vừa kết thúc
+                continue
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Luồng nền lấy mẫu tree_rss_mb() trong lúc 1 bước chạy, giữ giá trị lớn nhất
+class RssSampler(threading.Thread):
+    def __init__(self, interval=rss_interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = tree_rss_mb()
+        self._done = threading.Event()
+        if self.peak is not None:
+            self.start()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, tree_rss_mb() or 0)
+
+    def stop(self):
+        if self.peak is None:
+            return None
+        self._done.set()
+        self.join()
+        return round(max(self.peak, tree_rss_mb() or 0), 1)
+
+
+def stage_enabled(env, name):
+    value = os.environ.get(env, "")
+    return value == "all" or name in [s.strip() for s in value.split(",") if s.strip()]
+
+
+def write_run(run):
+    os.makedirs(metrics_folder, exist_ok=True)
+    path = metrics_folder + os.sep + f"{run['name']}_{run['started_at'].replace(':', '')}.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run, f, ensure_ascii=False, indent=2, default=str)
+    return path
+
+
+# 1 lần chạy (gồm nhiều bước), ghi ra 1 file JSON khi kết thúc
+@contextlib.contextmanager
+def run(name):
+    global _run
+    if _run is not None:
+        yield _run
+        return
+    _run = {
+        "name": name,
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "stages": [],
+    }
+    try:
+        yield _run
+    finally:
+        current, _run = _run, None
+        print(f"Metrics: {write_run(current)}")
+
+
+# Bắt đầu tracemalloc cho 1 bước (nếu bật qua TRACE_MEMORY); trả về True nếu bước này tự bật
+# Nếu nơi khác đã bật (vd. bench_crawl.py đang đo) thì không reset đỉnh của họ
+def start_memory_trace(name):
+    if not stage_enabled(trace_env, name) or tracemalloc.is_tracing():
+        return False
+    tracemalloc.start()
+    return True
+
+
+def stop_memory_trace(started):
+    if not started:
+        return None
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return round(peak / (1024 * 1024), 1)
+
+
+# 1 bước: đo thời gian thực, thời gian CPU, bộ nhớ đỉnh và gom các số liệu do bước ghi lại
+# Gọi lồng nhau (script chạy qua pipeline.py) thì dùng chung bản ghi của bước ngoài cùng
+@contextlib.contextmanager
+def stage(name):
+    global _stage
+    if _stage is not None:
+        yield _stage
+        return
+    with run(name) as current_run:
+        record = {"name": name, "status": "ok", "rows_in": None, "rows_out": None, "dropped": {}}
+        profiler = cProfile.Profile() if stage_enabled(profile_env, name) else None
+        _stage = record
+        traced = start_memory_trace(name)
+        sampler = RssSampler()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        except BaseException:
+            record["status"] = "error"
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                record["profile"] = save_profile(profiler, current_run, name)
+            record["wall_seconds"] = round(time.perf_counter() - wall, 3)
+            record["cpu_seconds"] = round(time.process_time() - cpu, 3)
+            record["peak_rss_mb"] = sampler.stop()
+            record["process_peak_rss_mb"] = process_peak_rss_mb()
+            if traced:
+                record["peak_traced_mb"] = stop_memory_trace(traced)
+            current_run["stages"].append(record)
+            _stage = None
+
+
+# Lưu file .prof (mở bằng snakeviz / pstats) và trả về các hàm tốn thời gian nhất
+def save_profile(profiler, current_run, name):
+    os.makedirs(metrics_folder, exist_ok=True)
+    path = metrics_folder + os.sep + f"{current_run['name']}_{name}.prof"
+    profiler.dump_stats(path)
+    st = pstats.Stats(profiler)
+    top = sorted(st.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:profile_top]
+    return {
+        "file": path,
+        "top": [{"function": f"{fn[0]}:{fn[1]}({fn[2]})", "calls": v[1],
+                 "total_seconds": round(v[2], 4), "cum_seconds": round(v[3], 4)}
+                for fn, v in top],
+    }
+
+
+# Bước không chạy (dùng kết quả cũ / bỏ qua) vẫn được ghi vào lần chạy để dễ đối chiếu
+def skipped(name, reason):
+    if _run is not None:
+        _run["stages"].append({"name": name, "status": reason})
+
+
+# Ghi số liệu vào bước đang chạy (không có bước nào thì bỏ qua)
+def record(**values):
+    if _stage is not None:
+        _stage.update(values)
+
+
+def add_rows(rows_in=0, rows_out=0):
+    if _stage is not None:
+        _stage["rows_in"] = (_stage["rows_in"] or 0) + rows_in
+        _stage["rows_out"] = (_stage["rows_out"] or 0) + rows_out
+
+
+def add_dropped(filter_name, n):
+    if _stage is not None:
+        _stage["dropped"][filter_name] = _stage["dropped"].get(filter_name, 0) + int(n)
+
+
+# Histogram độ trễ (giây) theo latency_buckets_ms, kèm các phân vị
+def latency_histogram(latencies):
+    ms = np.asarray(latencies, dtype="float64") * 1000
+    counts, _ = np.histogram(ms, bins=latency_buckets_ms)
+    labels = [f"{int(lo)}-{int(hi)}ms" if np.isfinite(hi) else f">{int(lo)}ms"
+              for lo, hi in zip(latency_buckets_ms[:-1], latency_buckets_ms[1:])]
+    summary = {"buckets": dict(zip(labels, counts.tolist()))}
+    if len(ms):
+        summary.update({f"p{q}_ms": round(float(np.percentile(ms, q)), 1) for q in (50, 90, 99)})
+    return summary
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import random
+import time
+
+from aiohttp import web
+
+# Giá trị mẫu cho các trường của tin chi tiết
+SAMPLE_VALUES = {
+    "mfdate": ["2010", "2015", "2018", "2020", "2023"],
+    "carorigin": ["Việt Nam", "Thái Lan", "Nhật Bản", "Hàn Quốc"],
+    "address": [
+        "Phường Nghĩa Tân, Quận Cầu Giấy, Hà Nội",
+        "Phường Hà Cầu, Quận Hà Đông, Hà Nội",
+        "Xã Tiên Dương, Huyện Đông Anh, Hà Nội",
+    ],
+    "cartype": ["Sedan", "SUV / Cross over", "Hatchback"],
+    "mileage_v2": ["30000 km", "80000 km", "150000 km"],
+    "gearbox": ["Tự động", "Số sàn"],
+    "condition_ad": ["Đã sử dụng", "Mới"],
+    "fuel": ["Xăng", "Dầu", "Hybrid"],
+    "carbrand": ["Toyota", "Kia", "Hyundai", "Mazda"],
+    "carmodel": ["Vios", "Morning", "Accent", "CX-5"],
+}
+
+
+# Server giả lập gateway chotot (/v1/public/ad-listing) để đo crawler không cần mạng
+# latency: "fixed" | "uniform" | "lognormal" | "exponential", latency_ms là trung bình
+# error_rate: tỉ lệ trả 503, throttle_rate: tỉ lệ trả 429 kèm Retry-After
+# extra_params: số tham số thừa trong mỗi tin để tăng kích thước payload
+class MockGateway:
+    def __init__(self, n_ads=3000, latency="lognormal", latency_ms=50.0,
+                 error_rate=0.0, throttle_rate=0.0, retry_after=1,
+                 extra_params=0, seed=0):
+        self.n_ads = n_ads
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.extra_params = extra_params
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self._runner = None
+
+    def _delay(self):
+        mean = self.latency_ms / 1000
+        if self.latency == "fixed":
+            return mean
+        if self.latency == "uniform":
+            return self.rng.uniform(0, 2 * mean)
+        if self.latency == "exponential":
+            return self.rng.expovariate(1 / mean) if mean > 0 else 0.0
+        if self.latency == "lognormal":
+            # sigma = 0.75 cho đuôi dài giống mạng thật; mu chỉnh để trung bình bằng latency_ms
+            return self.rng.lognormvariate(0, 0.75) * mean / 1.3246 if mean > 0 else 0.0
+        raise ValueError(f"Không hỗ trợ phân phối độ trễ: {self.latency}")
+
+    # Trả về response lỗi giả lập (hoặc None nếu request này thành công)
+    def _fault(self):
+        r = self.rng.random()
+        if r < self.throttle_rate:
+            return web.Response(status=429, headers={"Retry-After": str(self.retry_after)})
+        if r < self.throttle_rate + self.error_rate:
+            return web.Response(status=503)
+        return None
+
+    async def handle_list(self, request):
+        self.requests += 1
+        await asyncio.sleep(self._delay())
+        fault = self._fault()
+        if fault is not None:
+            return fault
+        offset = int(request.query.get("o", 0))
+        limit = int(request.query.get("limit", 20))
+        # Mỗi khu vực có dải list_id riêng để các phân mảnh không trùng nhau
+        base = int(request.query.get("region_v2", 0)) * 1_000_000
+        ids = range(offset, min(offset + limit, self.n_ads))
+        return web.json_response({"ads": [{"list_id": base + i} for i in ids]})
+
+    async def handle_detail(self, request):
+        self.requests += 1
+        await asyncio.sleep(self._delay())
+        fault = self._fault()
+        if fault is not None:
+            return fault
+        list_id = int(request.match_info["list_id"])
+        rng = random.Random(list_id)  # cùng list_id -> cùng nội dung
+        params = [{"id": k, "value": rng.choice(v)} for k, v in SAMPLE_VALUES.items()]
+        params += [{"id": f"extra_{i}", "value": "x" * 32} for i in range(self.extra_params)]
+        ad = {
+            "list_id": list_id,
+            "list_time": int(time.time() * 1000),
+            "price": rng.randrange(100, 3000) * 1_000_000,
+        }
+        return web.json_response({"ad": ad, "params": params, "parameters": []})
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_get("/v1/public/ad-listing", self.handle_list)
+        app.router.add_get("/v1/public/ad-listing/{list_id}", self.handle_detail)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://{host}:{port}/v1/public/ad-listing"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def serve(args):
+    gateway = MockGateway(n_ads=args.ads, latency=args.latency, latency_ms=args.latency_ms,
+                          error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                          extra_params=args.extra_params)
+    url = await gateway.start(port=args.port)
+    print("Mock gateway chạy tại:", url, flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await gateway.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock chotot gateway")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--ads", type=int, default=3000)
+    parser.add_argument("--latency", default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--extra-params", type=int, default=0)
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,201 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import runpy
+import sys
+import time
+
+import metrics
+import storage
+
+dir_path = os.path.dirname(os.path.abspath(__file__))
+state_path = storage.data_folder + os.sep + ".pipeline_state.json"
+plots_dir = "./plots_main"  # giống OUT_DIR trong plot_graph.py (tính theo thư mục đang chạy)
+
+# Các bước của pipeline:
+# script: file chạy, deps: bước phía trước, code: file mã nguồn ảnh hưởng kết quả,
+# tables_in / tables_out: bảng trong storage, files_out: file/thư mục kết quả khác
+STAGES = [
+    {
+        "name": "crawl",
+        "script": "crawl.py",
+        "deps": [],
+        "code": ["crawl.py", "crawl_state.py", "data_cleaning.py", "dedup.py", "http_cache.py",
+                 "rate_limiter.py", "running_stats.py", "storage.py"],
+        "tables_in": [],
+        "tables_out": ["oto_chitiet"],
+        "files_out": [],
+    },
+    {
+        "name": "cleaning",
+        "script": "data_cleaning.py",
+        "deps": ["crawl"],
+        "code": ["data_cleaning.py", "running_stats.py", "storage.py"],
+        "tables_in": ["oto_chitiet"],
+        "tables_out": ["du_lieu_oto"],
+        "files_out": [],
+    },
+    {
+        "name": "scaling",
+        "script": "chuan_hoa.py",
+        "deps": ["cleaning"],
+        "code": ["chuan_hoa.py", "running_stats.py", "storage.py"],
+        "tables_in": ["du_lieu_oto"],
+        "tables_out": ["du_lieu_oto_scaled"],
+        "files_out": [],
+    },
+    {
+        "name": "clustering",
+        "script": "k_means.py",
+        "deps": ["cleaning"],
+        "code": ["k_means.py", "clustering.py", "location.py", "running_stats.py", "storage.py",
+                 "summaries.py"],
+        "tables_in": ["du_lieu_oto"],
+        "tables_out": [],
+        "files_out": [dir_path + os.sep + "phan_tich_phan_khuc.csv",
+                      storage.data_folder + os.sep + "segment_model.joblib"],
+    },
+    {
+        "name": "plotting",
+        "script": "plot_graph.py",
+        "deps": ["cleaning"],
+        "code": ["plot_graph.py", "kde.py", "location.py", "running_stats.py", "storage.py",
+                 "summaries.py"],
+        "tables_in": ["du_lieu_oto"],
+        "tables_out": [],
+        "files_out": [plots_dir],
+    },
+]
+
+
+# Danh sách file dữ liệu của 1 bảng (các part Parquet và file CSV nếu có)
+def table_files(name):
+    files = []
+    folder = storage.parquet_path(name)
+    if os.path.isdir(folder):
+        files += [folder + os.sep + f for f in sorted(os.listdir(folder))]
+    if os.path.exists(storage.csv_path(name)):
+        files.append(storage.csv_path(name))
+    return files
+
+
+def hash_file(h, path):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+
+
+# Dấu vân tay của 1 bước = hash(nội dung mã nguồn + nội dung dữ liệu vào + tham số)
+def fingerprint(stage, params):
+    h = hashlib.sha256()
+    for name in stage["code"]:
+        h.update(name.encode("utf-8"))
+        hash_file(h, dir_path + os.sep + name)
+    for table in stage["tables_in"]:
+        h.update(table.encode("utf-8"))
+        for path in table_files(table):
+            hash_file(h, path)
+    h.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def outputs_exist(stage):
+    return (all(storage.table_exists(t) for t in stage["tables_out"])
+            and all(os.path.exists(p) for p in stage["files_out"]))
+
+
+def load_state():
+    if os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+# Tập các bước phụ thuộc (trực tiếp hoặc gián tiếp) vào các bước cho trước
+def downstream(names):
+    result = set(names)
+    changed = True
+    while changed:
+        changed = False
+        for stage in STAGES:
+            if stage["name"] not in result and result.intersection(stage["deps"]):
+                result.add(stage["name"])
+                changed = True
+    return result
+
+
+def run_stage(stage):
+    # chạy script như khi gọi "python <script>"
+    sys.path.insert(0, dir_path)
+    try:
+        with metrics.stage(stage["name"]):
+            runpy.run_path(dir_path + os.sep + stage["script"], run_name="__main__")
+    finally:
+        sys.path.remove(dir_path)
+
+
+def run(force=(), crawl=False, only=None):
+    # Không mở cửa sổ biểu đồ khi chạy pipeline
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    params = {"export_csv": storage.export_csv}
+    state = load_state()
+    forced = downstream(force)
+
+    with metrics.run("pipeline"):
+        run_stages(state, params, forced, crawl, only)
+
+
+def run_stages(state, params, forced, crawl, only):
+    for stage in STAGES:
+        name = stage["name"]
+        if only and name not in only:
+            continue
+        # crawl cần mạng và không có dữ liệu vào để so sánh: chỉ chạy khi được yêu cầu
+        if name == "crawl" and not crawl and name not in forced:
+            print(f"[{name}] bỏ qua (dùng --crawl để crawl lại)")
+            metrics.skipped(name, "skipped")
+            continue
+
+        fp = fingerprint(stage, params)
+        cached = state.get(name, {}).get("fingerprint")
+        if name not in forced and name != "crawl" and cached == fp and outputs_exist(stage):
+            print(f"[{name}] không đổi, dùng kết quả cũ")
+            metrics.skipped(name, "cached")
+            continue
+
+        print(f"[{name}] đang chạy {stage['script']}...")
+        start = time.time()
+        run_stage(stage)
+        state[name] = {
+            "fingerprint": fp,
+            "ran_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(time.time() - start, 2),
+        }
+        save_state(state)
+        print(f"[{name}] xong sau {state[name]['seconds']} giây")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chạy pipeline, bỏ qua các bước không đổi")
+    parser.add_argument("--crawl", action="store_true", help="chạy cả bước crawl")
+    parser.add_argument("--force", nargs="*", default=[], help="chạy lại các bước này và các bước sau")
+    parser.add_argument("--only", nargs="*", help="chỉ xét các bước này")
+    parser.add_argument("--profile", nargs="*",
+                        help="chạy cProfile cho các bước này (không ghi tên: mọi bước)")
+    parser.add_argument("--trace-memory", nargs="*",
+                        help="đo cấp phát bằng tracemalloc cho các bước này (chậm hơn; "
+                             "không ghi tên: mọi bước)")
+    args = parser.parse_args()
+    if args.profile is not None:
+        os.environ[metrics.profile_env] = ",".join(args.profile) or "all"
+    if args.trace_memory is not None:
+        os.environ[metrics.trace_env] = ",".join(args.trace_memory) or "all"
+    run(force=args.force, crawl=args.crawl, only=args.only)
@@ -1,49 +1,78 @@
+import hashlib
+import inspect
+import json
+import multiprocessing
 import os
-from io import StringIO
-import math
+import sys
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 
-dir_path = os.path.dirname(__file__)
+import kde
+import location
+import metrics
+import storage
+import summaries
 
-output_folder = dir_path + os.sep + "data"
-INPUT_CSV = output_folder + os.sep + "du_lieu_oto.csv"
+INPUT_TABLE = "du_lieu_oto"
+# Các cột cần cho biểu đồ (không đọc các cột khác)
+PLOT_COLUMNS = ['Năm SX', 'Số km đã đi', 'Giá', 'Địa điểm']
 OUT_DIR = "./plots_main"
-CLEANED_PATH = "./cleaned_car_data.csv"
+KDE_BW_RULE = "normal"  # "normal" (1.06 * std * n^-1/5) | "silverman" (0.9 * min(std, IQR/1.34) * n^-1/5)
+KDE_GRID_SIZE = 300
+DPI = 200
+HEADLESS = True        # dùng backend Agg (không mở cửa sổ), cần khi vẽ trong tiến trình con
+PARALLEL = True        # vẽ các biểu đồ độc lập song song trên pool tiến trình
+N_JOBS = None          # None: theo số CPU
+FORCE_REDRAW = False   # True: vẽ lại cả các biểu đồ không đổi
+STATE_PATH = os.path.join(OUT_DIR, ".plot_state.json")
+AGG_THRESHOLD = 200_000  # từ số dòng này, scatter/contour vẽ từ dữ liệu đã gom lưới
+GRID_BINS = 100          # số ô lưới theo trục số km / giá (năm SX gom theo từng năm)
 
 os.makedirs(OUT_DIR, exist_ok=True)
 
-def extract_khuvuc(dia_diem):
-    if pd.isna(dia_diem):
-        return None
-    s = str(dia_diem)
-    for marker in ["Quận", "Huyện", "Thị xã", "Xã", "Phường"]:
-        if marker in s:
-            start = s.find(marker)
-            rest = s[start:]
-            parts = rest.split(",")
-            return parts[0].strip()
-    return s.split(",")[0].strip()
-
-def simple_kde(xs, data, bw):
-    data = np.asarray(data)
-    factor = 1.0 / (bw * math.sqrt(2 * math.pi))
-    return np.array([np.mean(factor * np.exp(-0.5 * ((x - data) / bw) ** 2)) for x in xs])
-
-def load_and_clean(path):
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"INPUT_CSV not found: {path}")
-    df = pd.read_csv(path, parse_dates=["Ngày đăng"], dayfirst=False)
-    df['Năm SX'] = pd.to_numeric(df.get('Năm SX'), errors='coerce')
-    df['Số km đã đi'] = pd.to_numeric(df.get('Số km đã đi'), errors='coerce')
-    df['Giá'] = pd.to_numeric(df.get('Giá'), errors='coerce')
-    df['Khu vực'] = df['Địa điểm'].apply(extract_khuvuc)
+# Import matplotlib khi thật sự cần vẽ (chọn backend Agg trước nếu chạy headless)
+def pyplot():
+    if HEADLESS and "matplotlib.pyplot" not in sys.modules:
+        import matplotlib
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def load_and_clean(table):
+    if not storage.table_exists(table):
+        raise FileNotFoundError(f"INPUT_TABLE not found: {table}")
+    # kiểu dữ liệu đã cố định theo schema nên không cần to_numeric lại
+    df = storage.load_table(table, columns=PLOT_COLUMNS)
+    df['Khu vực'] = location.khuvuc_column(df['Địa điểm'])
     return df
 
-def plot_line_mean_price_by_year(df, out_dir):
-    g = df.groupby('Năm SX')['Giá'].agg(['mean','count','std']).reset_index().dropna()
+# Lấy các cột dạng float, bỏ dòng thiếu dữ liệu
+def numeric_columns(df, cols):
+    values = df[cols].to_numpy(dtype="float64", na_value=np.nan)
+    values = values[~np.isnan(values).any(axis=1)]
+    return [values[:, i] for i in range(len(cols))]
+
+# Biên các ô lưới: mỗi năm 1 ô, các trục khác chia đều GRID_BINS ô
+def year_edges(years):
+    return np.arange(np.floor(years.min()) - 0.5, np.ceil(years.max()) + 1.5)
+
+def even_edges(values):
+    return np.linspace(values.min(), values.max(), GRID_BINS + 1)
+
+def centers(edges):
+    return (edges[:-1] + edges[1:]) / 2
+
+# Số điểm và giá trung bình của từng ô lưới (x, y); ô rỗng có mean = NaN
+def grid_mean(x, y, z, x_edges, y_edges):
+    counts, _, _ = np.histogram2d(x, y, bins=[x_edges, y_edges])
+    sums, _, _ = np.histogram2d(x, y, bins=[x_edges, y_edges], weights=z)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(counts > 0, sums / counts, np.nan)
+    return counts, mean
+
+# g: bảng theo năm ('Năm SX', 'mean', 'count', 'std') từ summaries.year_table
+def plot_line_mean_price_by_year(g, out_dir):
+    plt = pyplot()
     plt.figure(figsize=(10,5))
     plt.plot(g['Năm SX'], g['mean'], marker='o')
     plt.title('Giá trung bình theo Năm SX')
@@ -51,11 +80,14 @@ def plot_line_mean_price_by_year(df, out_dir):
     plt.ylabel('Giá trung bình (VND)')
     plt.grid(True)
     plt.tight_layout()
-    plt.savefig(os.path.join(out_dir, "line_mean_price_by_year.png"), dpi=200)
+    plt.savefig(os.path.join(out_dir, "line_mean_price_by_year.png"), dpi=DPI)
     plt.close()
     return g
 
 def plot_scatter_price_vs_km(df, out_dir):
+    plt = pyplot()
+    if len(df) >= AGG_THRESHOLD:
+        return plot_density_price_vs_km(df, out_dir)
     year_vals = df['Năm SX'].fillna(df['Năm SX'].median())
     sizes = (year_vals - year_vals.min()).fillna(0) * 2 + 20
     plt.figure(figsize=(9,6))
@@ -65,10 +97,30 @@ def plot_scatter_price_vs_km(df, out_dir):
     plt.ylabel('Giá (VND)')
     plt.ylim(bottom=0)
     plt.tight_layout()
-    plt.savefig(os.path.join(out_dir, "scatter_price_vs_km.png"), dpi=200)
+    plt.savefig(os.path.join(out_dir, "scatter_price_vs_km.png"), dpi=DPI)
+    plt.close()
+
+# Bản gom lưới của scatter: tô màu theo số tin trong mỗi ô (km, giá)
+def plot_density_price_vs_km(df, out_dir):
+    plt = pyplot()
+    from matplotlib.colors import LogNorm
+    km, price = numeric_columns(df, ['Số km đã đi', 'Giá'])
+    x_edges, y_edges = even_edges(km), even_edges(price)
+    counts, _, _ = np.histogram2d(km, price, bins=[x_edges, y_edges])
+    plt.figure(figsize=(9,6))
+    plt.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.T, 0), norm=LogNorm(), shading='flat')
+    cbar = plt.colorbar()
+    cbar.set_label('Số tin')
+    plt.title(f'Giá vs Số km đã đi (mật độ, {len(km):,} tin)')
+    plt.xlabel('Số km đã đi')
+    plt.ylabel('Giá (VND)')
+    plt.ylim(bottom=0)
+    plt.tight_layout()
+    plt.savefig(os.path.join(out_dir, "scatter_price_vs_km.png"), dpi=DPI)
     plt.close()
 
 def plot_errorbar_mean_price_by_year(g, out_dir):
+    plt = pyplot()
     valid = g[g['count'] >= 2]
     plt.figure(figsize=(10,5))
     plt.errorbar(valid['Năm SX'], valid['mean'], yerr=valid['std'], marker='o', linestyle='-')
@@ -77,10 +129,13 @@ def plot_errorbar_mean_price_by_year(g, out_dir):
     plt.ylabel('Giá (VND)')
     plt.grid(True)
     plt.tight_layout()
-    plt.savefig(os.path.join(out_dir, "errorbar_mean_price_by_year.png"), dpi=200)
+    plt.savefig(os.path.join(out_dir, "errorbar_mean_price_by_year.png"), dpi=DPI)
     plt.close()
 
 def plot_contour_price_km_year(df, out_dir):
+    plt = pyplot()
+    if len(df) >= AGG_THRESHOLD:
+        return plot_grid_contour_price_km_year(df, out_dir)
     cont_df = df[['Số km đã đi','Năm SX','Giá']].dropna()
     if len(cont_df) >= 10 and cont_df['Số km đã đi'].nunique() >= 5:
         plt.figure(figsize=(9,6))
@@ -91,41 +146,73 @@ def plot_contour_price_km_year(df, out_dir):
         cbar = plt.colorbar()
         cbar.set_label('Giá (VND)')
         plt.tight_layout()
-        plt.savefig(os.path.join(out_dir, "contour_price_km_year.png"), dpi=200)
+        plt.savefig(os.path.join(out_dir, "contour_price_km_year.png"), dpi=DPI)
         plt.close()
     else:
         print("Contour skipped: not enough diverse points (need >=10 records and varied km).")
 
+# Bản gom lưới của contour: vẽ contourf từ bề mặt giá trung bình trên lưới (km, năm)
+# thay vì tam giác hóa Delaunay trên từng tin
+def plot_grid_contour_price_km_year(df, out_dir):
+    plt = pyplot()
+    km, year, price = numeric_columns(df, ['Số km đã đi', 'Năm SX', 'Giá'])
+    x_edges, y_edges = even_edges(km), year_edges(year)
+    if len(y_edges) < 3 or km.min() == km.max():
+        print("Contour skipped: need >=2 distinct years and varied km.")
+        return
+    _, mean = grid_mean(km, year, price, x_edges, y_edges)
+    plt.figure(figsize=(9,6))
+    plt.contourf(centers(x_edges), centers(y_edges), np.ma.masked_invalid(mean.T), levels=12)
+    plt.title('Contour of Giá over (Số km, Năm SX)')
+    plt.xlabel('Số km đã đi')
+    plt.ylabel('Năm SX')
+    cbar = plt.colorbar()
+    cbar.set_label('Giá TB (VND)')
+    plt.tight_layout()
+    plt.savefig(os.path.join(out_dir, "contour_price_km_year.png"), dpi=DPI)
+    plt.close()
+
 def plot_histogram_price_kde(df, out_dir):
-    prices = df['Giá'].dropna().values
+    plt = pyplot()
+    prices = df['Giá'].dropna().to_numpy(dtype=float)
     plt.figure(figsize=(9,5))
     plt.hist(prices, bins=20, density=True, alpha=0.7)
     if len(prices) > 1:
-        std_p = prices.std()
-        bw = 1.06 * std_p * (len(prices) ** (-1/5))
-        xs = np.linspace(prices.min(), prices.max(), 300)
-        ys = simple_kde(xs, prices, bw)
+        xs = np.linspace(prices.min(), prices.max(), KDE_GRID_SIZE)
+        ys = kde.binned_kde(xs, prices, rule=KDE_BW_RULE)
         plt.plot(xs, ys)
     plt.title('Histogram of Giá (density) with KDE estimate')
     plt.xlabel('Giá (VND)')
     plt.ylabel('Density')
     plt.tight_layout()
-    plt.savefig(os.path.join(out_dir, "histogram_price_kde.png"), dpi=200)
+    plt.savefig(os.path.join(out_dir, "histogram_price_kde.png"), dpi=DPI)
     plt.close()
 
 def plot_3d_scatter(df, out_dir):
+    plt = pyplot()
+    from mpl_toolkits.mplot3d import Axes3D  # noqa: F401
     fig = plt.figure(figsize=(9,7))
     ax = fig.add_subplot(111, projection='3d')
-    ax.scatter(df['Năm SX'], df['Số km đã đi'], df['Giá'], s=20)
+    if len(df) >= AGG_THRESHOLD:
+        # mỗi ô (năm, km) 1 điểm tại giá trung bình, kích thước theo log số tin
+        year, km, price = numeric_columns(df, ['Năm SX', 'Số km đã đi', 'Giá'])
+        x_edges, y_edges = year_edges(year), even_edges(km)
+        counts, mean = grid_mean(year, km, price, x_edges, y_edges)
+        xi, yi = np.nonzero(counts)
+        ax.scatter(centers(x_edges)[xi], centers(y_edges)[yi], mean[xi, yi],
+                   s=10 + 10 * np.log10(counts[xi, yi]), c=np.log10(counts[xi, yi]))
+    else:
+        ax.scatter(df['Năm SX'], df['Số km đã đi'], df['Giá'], s=20)
     ax.set_xlabel('Năm SX')
     ax.set_ylabel('Số km đã đi')
     ax.set_zlabel('Giá (VND)')
     ax.set_title('3D scatter: Năm SX vs Số km vs Giá')
     plt.tight_layout()
-    plt.savefig(os.path.join(out_dir, "3d_scatter_year_km_price.png"), dpi=200)
+    plt.savefig(os.path.join(out_dir, "3d_scatter_year_km_price.png"), dpi=DPI)
     plt.close()
 
 def plot_bar_count_by_khuvuc(df, out_dir):
+    plt = pyplot()
     counts = df['Khu vực'].value_counts().nlargest(15)
     plt.figure(figsize=(11,6))
     counts.plot(kind='bar')
@@ -134,19 +221,108 @@ def plot_bar_count_by_khuvuc(df, out_dir):
     plt.ylabel('Số tin')
     plt.xticks(rotation=45, ha='right')
     plt.tight_layout()
-    plt.savefig(os.path.join(out_dir, "bar_count_by_khuvuc.png"), dpi=200)
+    plt.savefig(os.path.join(out_dir, "bar_count_by_khuvuc.png"), dpi=DPI)
     plt.close()
 
-def main():
-    df = load_and_clean(INPUT_CSV)
-    g = plot_line_mean_price_by_year(df, OUT_DIR)
-    plot_scatter_price_vs_km(df, OUT_DIR)
-    plot_errorbar_mean_price_by_year(g, OUT_DIR)
-    plot_contour_price_km_year(df, OUT_DIR)
-    plot_histogram_price_kde(df, OUT_DIR)
-    plot_3d_scatter(df, OUT_DIR)
-    plot_bar_count_by_khuvuc(df, OUT_DIR)
+# Các biểu đồ: cols là lát dữ liệu mà biểu đồ dùng, params là tham số ảnh hưởng tới hình
+# source "year_summary": dùng bảng theo năm cập nhật dần (summaries.py) thay vì dữ liệu từng tin
+# Xếp biểu đồ tốn thời gian lên trước để pool bắt đầu chúng sớm nhất
+PLOTS = [
+    {"func": plot_contour_price_km_year, "file": "contour_price_km_year.png",
+     "cols": ['Số km đã đi', 'Năm SX', 'Giá'],
+     "params": {"agg_threshold": AGG_THRESHOLD, "bins": GRID_BINS}},
+    {"func": plot_3d_scatter, "file": "3d_scatter_year_km_price.png",
+     "cols": ['Năm SX', 'Số km đã đi', 'Giá'],
+     "params": {"agg_threshold": AGG_THRESHOLD, "bins": GRID_BINS}},
+    {"func": plot_scatter_price_vs_km, "file": "scatter_price_vs_km.png",
+     "cols": ['Số km đã đi', 'Giá', 'Năm SX'],
+     "params": {"agg_threshold": AGG_THRESHOLD, "bins": GRID_BINS}},
+    {"func": plot_histogram_price_kde, "file": "histogram_price_kde.png",
+     "cols": ['Giá'], "params": {"bw_rule": KDE_BW_RULE, "grid": KDE_GRID_SIZE}},
+    {"func": plot_line_mean_price_by_year, "file": "line_mean_price_by_year.png",
+     "cols": ['Năm SX', 'mean', 'count', 'std'], "source": "year_summary", "params": {}},
+    {"func": plot_errorbar_mean_price_by_year, "file": "errorbar_mean_price_by_year.png",
+     "cols": ['Năm SX', 'mean', 'count', 'std'], "source": "year_summary", "params": {}},
+    {"func": plot_bar_count_by_khuvuc, "file": "bar_count_by_khuvuc.png",
+     "cols": ['Khu vực'], "params": {}},
+]
+
+def load_state():
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+def save_state(state):
+    with open(STATE_PATH, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+# Mã nguồn mà các biểu đồ phụ thuộc: hàm vẽ gọi các hàm phụ trợ trong file này
+# (gom lưới, density/contour...) và kde.binned_kde, nên hash cả 2 module
+# thay vì chỉ hàm vẽ (sửa hàm phụ trợ thì phải vẽ lại)
+def code_fingerprint():
+    h = hashlib.sha256()
+    for module in (sys.modules[__name__], kde):
+        h.update(inspect.getsource(module).encode("utf-8"))
+    return h.hexdigest()
+
+# Dấu vân tay của 1 biểu đồ = hash(lát dữ liệu vào + tham số + mã nguồn liên quan)
+def plot_fingerprint(plot, data, code):
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    h.update(json.dumps({"cols": plot["cols"], "dpi": DPI, **plot["params"]},
+                        sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    h.update(code.encode("utf-8"))
+    h.update(plot["func"].__name__.encode("utf-8"))
+    return h.hexdigest()
+
+# Chạy trong tiến trình con: vẽ 1 biểu đồ theo tên hàm
+def render(name, data, out_dir):
+    globals()[name](data, out_dir)
+    return name
+
+def main(parallel=PARALLEL, force=FORCE_REDRAW):
+    df = load_and_clean(INPUT_TABLE)
+    sources = {"year_summary": summaries.year_table(summaries.refresh())}
+    state = load_state()
+    code = code_fingerprint()
+
+    # Chỉ vẽ các biểu đồ có dữ liệu vào / tham số / mã nguồn thay đổi
+    todo = []
+    for plot in PLOTS:
+        name = plot["func"].__name__
+        data = sources[plot["source"]] if "source" in plot else df[plot["cols"]]
+        fp = plot_fingerprint(plot, data, code)
+        out_file = os.path.join(OUT_DIR, plot["file"])
+        if not force and state.get(name) == fp and os.path.exists(out_file):
+            print(f"{name}: không đổi, bỏ qua")
+            continue
+        todo.append((plot, data, fp))
+
+    if parallel and len(todo) > 1:
+        # tiến trình con cũng phải dùng Agg (không có cửa sổ)
+        os.environ.setdefault("MPLBACKEND", "Agg")
+        n_jobs = N_JOBS or min(len(todo), os.cpu_count() or 1)
+        # gửi hàm của module plot_graph (không phải __main__) để tiến trình con tìm được,
+        # kể cả khi file này được chạy qua pipeline.py
+        import plot_graph
+        with multiprocessing.Pool(n_jobs) as pool:
+            jobs = [(plot, fp, pool.apply_async(plot_graph.render,
+                                                (plot["func"].__name__, data, OUT_DIR)))
+                    for plot, data, fp in todo]
+            for plot, fp, job in jobs:
+                job.get()
+                state[plot["func"].__name__] = fp
+    else:
+        for plot, data, fp in todo:
+            render(plot["func"].__name__, data, OUT_DIR)
+            state[plot["func"].__name__] = fp
+    save_state(state)
+    metrics.add_rows(rows_in=len(df))
+    metrics.record(plots_rendered=len(todo), plots_unchanged=len(PLOTS) - len(todo))
+    print(f"Đã vẽ {len(todo)}/{len(PLOTS)} biểu đồ.")
     print("Plots saved to:", os.path.abspath(OUT_DIR))
 
 if __name__ == "__main__":
-    main()
+    with metrics.stage("plotting"):
+        main()
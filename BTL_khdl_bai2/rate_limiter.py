@@ -0,0 +1,169 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+# Các mã lỗi cho thấy gateway đang quá tải -> cần giảm tốc
+THROTTLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+# Đọc header Retry-After (số giây hoặc ngày giờ HTTP) -> số giây cần chờ
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Bộ điều tốc cố định: giữ hành vi cũ (semaphore + chờ 1 giây khi lỗi)
+class FixedRateLimiter:
+    def __init__(self, concurrency=10, retry_delay=1.0):
+        self.concurrency = concurrency
+        self.retry_delay = retry_delay
+        self._sem = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        await self._sem.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._sem.release()
+
+    def on_success(self, latency):
+        pass
+
+    def on_error(self, status=None, retry_after=None):
+        pass
+
+    def backoff(self, attempt, retry_after=None):
+        return retry_after if retry_after is not None else self.retry_delay
+
+
+# Bộ điều tốc thích nghi: token bucket + giới hạn song song kiểu AIMD
+# - Khởi động chậm (slow start): nhân đôi mỗi "cửa sổ" cho tới lỗi quá tải đầu tiên
+# - Sau đó tăng cộng tốc độ / số request song song khi độ trễ ổn định
+# - Giảm theo hệ số khi gặp 429, hoặc khi tỉ lệ lỗi 5xx/timeout vượt ngưỡng; tôn trọng Retry-After
+class AdaptiveRateLimiter:
+    def __init__(self, rate=10.0, concurrency=10,
+                 min_rate=1.0, max_rate=50.0,
+                 min_concurrency=1, max_concurrency=50,
+                 rate_step=1.0, decrease_factor=0.5,
+                 target_latency=2.0, error_threshold=0.1,
+                 base_delay=0.5, max_delay=30.0):
+        self.rate = float(rate)
+        self.concurrency = concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.rate_step = rate_step
+        self.decrease_factor = decrease_factor
+        self.target_latency = target_latency
+        self.error_threshold = error_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._latency_ewma = None
+        self._error_ewma = 0.0
+        self._success_streak = 0
+        self._slow_start = True
+        self._in_flight = 0
+        self._cond = asyncio.Condition()
+
+    # Nạp thêm token theo thời gian đã trôi qua, tối đa bằng 1 giây tốc độ
+    def _refill(self, now):
+        self._tokens = min(max(self.rate, 1.0),
+                           self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:  # đang bị gateway yêu cầu chờ
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self.concurrency)
+            self._in_flight += 1
+        try:
+            await self._take_token()
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self, latency):
+        self._error_ewma *= 0.95
+        if self._latency_ewma is None:
+            self._latency_ewma = latency
+        else:
+            self._latency_ewma = 0.8 * self._latency_ewma + 0.2 * latency
+
+        if self._latency_ewma > self.target_latency or self._error_ewma > self.error_threshold:
+            self._success_streak = 0
+            return
+
+        # Mỗi "cửa sổ" thành công (bằng số request song song) tăng 1 bậc:
+        # nhân đôi khi đang slow start, tăng cộng sau đó
+        self._success_streak += 1
+        if self._success_streak >= self.concurrency:
+            self._success_streak = 0
+            if self._slow_start:
+                self.concurrency = min(self.max_concurrency, self.concurrency * 2)
+                self.rate = min(self.max_rate, self.rate * 2)
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                self.rate = min(self.max_rate, self.rate + self.rate_step)
+
+    def on_error(self, status=None, retry_after=None):
+        # status=None: lỗi mạng / timeout, cũng coi là tín hiệu quá tải
+        if status is not None and status not in THROTTLE_STATUSES:
+            return
+        now = time.monotonic()
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+
+        # 5xx/timeout lẻ tẻ không phải quá tải; chỉ giảm khi tỉ lệ lỗi gần đây vượt ngưỡng
+        # (429 là gateway yêu cầu giảm tốc trực tiếp nên luôn giảm)
+        self._error_ewma = 0.95 * self._error_ewma + 0.05
+        if status != 429 and self._error_ewma <= self.error_threshold:
+            return
+
+        # Giảm nhân, nhưng chỉ một lần cho mỗi đợt lỗi đồng thời
+        window = self._latency_ewma or 1.0
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self._success_streak = 0
+        self._slow_start = False
+        self.concurrency = max(self.min_concurrency,
+                               int(self.concurrency * self.decrease_factor))
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+
+    # Backoff lũy thừa với "full jitter"; ưu tiên Retry-After nếu có
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+# Thống kê gộp được (count, mean, M2 theo Welford/Chan, min, max)
+# Cập nhật theo từng lô và gộp 2 trạng thái mà không cần giữ dữ liệu gốc
+class RunningStats:
+    def __init__(self, count=0, mean=0.0, m2=0.0, min=np.inf, max=-np.inf):
+        self.count = int(count)
+        self.mean = float(mean)
+        self.m2 = float(m2)
+        self.min = float(min)
+        self.max = float(max)
+
+    def update(self, values):
+        values = np.asarray(values, dtype="float64")
+        values = values[~np.isnan(values)]
+        if len(values):
+            batch_mean = values.mean()
+            self.merge(RunningStats(len(values), batch_mean,
+                                    ((values - batch_mean) ** 2).sum(),
+                                    values.min(), values.max()))
+        return self
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / n
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / n
+        self.count = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def sum(self):
+        return self.mean * self.count
+
+    # Phương sai mẫu (ddof=1), giống pandas .var()
+    @property
+    def var(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def to_dict(self):
+        return {"count": self.count, "mean": self.mean, "m2": self.m2,
+                "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+
+# Mẫu ngẫu nhiên cỡ cố định (reservoir sampling) để ước lượng phân vị trên dữ liệu lớn
+# Khi tổng số giá trị <= capacity thì mẫu chính là toàn bộ dữ liệu (phân vị chính xác)
+class Reservoir:
+    def __init__(self, capacity=200_000, seed=42):
+        self.capacity = capacity
+        self.count = 0
+        self.sample = np.empty(0, dtype="float64")
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype="float64")
+        values = values[~np.isnan(values)]
+        free = self.capacity - len(self.sample)
+        if free > 0:
+            self.sample = np.concatenate([self.sample, values[:free]])
+            self.count += len(values[:free])
+            values = values[free:]
+        if len(values):
+            # Thuật toán R: phần tử thứ i được giữ với xác suất capacity / i
+            idx = self.count + 1 + np.arange(len(values))
+            j = (self._rng.random(len(values)) * idx).astype("int64")
+            keep = j < self.capacity
+            self.sample[j[keep]] = values[keep]
+            self.count += len(values)
+        return self
+
+    def quantile(self, q):
+        return np.quantile(self.sample, q) if len(self.sample) else np.nan
@@ -0,0 +1,305 @@
+import csv
+import glob
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq  # cần cho Parquet
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+dir_path = os.path.dirname(__file__)
+data_folder = dir_path + os.sep + "data"
+
+export_csv = True  # vẫn xuất thêm file CSV cạnh bảng Parquet (để mở bằng Excel, nộp bài...)
+compact_min_parts = 20     # chỉ gộp khi có ít nhất chừng này part nhỏ liền nhau
+small_part_rows = 100_000  # part ít dòng hơn thì coi là nhỏ (sinh ra khi nối thêm từng lô)
+
+# Schema cố định cho dữ liệu trao đổi giữa các bước
+# oto_chitiet: dữ liệu thô từ crawl.py (giữ nguyên dạng chuỗi như API trả về)
+RAW_SCHEMA = {
+    "Ngày đăng": "string",
+    "Năm SX": "string",
+    "Xuất xứ": "string",
+    "Địa điểm": "string",
+    "Kiểu dáng": "string",
+    "Số km đã đi": "string",
+    "Hộp số": "string",
+    "Tình trạng": "string",
+    "Nhiên liệu": "string",
+    "Giá": "Int64",
+    "Hãng xe": "string",
+    "Dòng xe": "string",
+    "dup_of": "Int64",  # list_id của tin gốc nếu tin này nghi là đăng lại (dedup.py)
+}
+
+# du_lieu_oto: dữ liệu đã làm sạch từ data_cleaning.py
+CLEAN_SCHEMA = {
+    "Ngày đăng": "datetime64[ns]",
+    "Năm SX": "Int16",
+    "Xuất xứ": "category",
+    "Địa điểm": "category",
+    "Kiểu dáng": "category",
+    "Số km đã đi": "Int32",
+    "Hộp số": "category",
+    "Tình trạng": "category",
+    "Nhiên liệu": "category",
+    "Giá": "Int64",
+    "Hãng xe": "category",
+    "Dòng xe": "category",
+}
+
+# du_lieu_oto_scaled: như du_lieu_oto nhưng các cột số đã chuẩn hóa
+SCALED_SCHEMA = dict(CLEAN_SCHEMA, **{
+    "Năm SX": "float32",
+    "Số km đã đi": "float32",
+    "Giá": "float32",
+})
+
+SCHEMAS = {
+    "oto_chitiet": RAW_SCHEMA,
+    "du_lieu_oto": CLEAN_SCHEMA,
+    "du_lieu_oto_scaled": SCALED_SCHEMA,
+}
+
+
+def parquet_path(name):
+    return data_folder + os.sep + name + ".parquet"
+
+
+def csv_path(name):
+    return data_folder + os.sep + name + ".csv"
+
+
+# Ép kiểu DataFrame theo schema; cột không có trong schema giữ nguyên
+def apply_schema(df, schema):
+    df = df.copy(deep=False)  # không sửa DataFrame của người gọi, không sao chép dữ liệu
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        s = df[col]
+        if dtype.startswith("datetime"):
+            df[col] = pd.to_datetime(s, errors="coerce")
+        elif dtype[0] in "IUf":  # Int*, UInt*, float*
+            if not pd.api.types.is_numeric_dtype(s):
+                s = pd.to_numeric(s, errors="coerce")
+            if dtype[0] in "IU":
+                s = s.round()
+                # giá trị vượt phạm vi của kiểu (vd. "3000000000 km" với Int32) coi là thiếu (NA)
+                # như giá trị không đọc được, thay vì lỗi khi ép kiểu
+                info = np.iinfo(pd.api.types.pandas_dtype(dtype).numpy_dtype)
+                s = s.mask(((s < info.min) | (s > info.max)).fillna(False))
+            df[col] = s.astype(dtype)
+        elif dtype == "string":
+            # crawl.py ghi "" khi tin không có trường đó -> coi là thiếu (NA) như khi đọc CSV
+            df[col] = s.astype("string").replace("", pd.NA)
+        else:
+            df[col] = s.astype(dtype)
+    return df
+
+
+# Kiểu khi đọc CSV: cột category đọc thẳng thành category (không qua chuỗi),
+# các cột khác đọc dạng chuỗi rồi ép kiểu theo schema
+def csv_dtypes(schema):
+    return {c: "category" if t == "category" else "string" for c, t in schema.items()}
+
+
+def table_exists(name):
+    return os.path.isdir(parquet_path(name)) or os.path.exists(csv_path(name))
+
+
+def clear_table(name):
+    if os.path.isdir(parquet_path(name)):
+        shutil.rmtree(parquet_path(name))
+    if os.path.exists(csv_path(name)):
+        os.remove(csv_path(name))
+
+
+def _write_part(df, name):
+    folder = parquet_path(name)
+    os.makedirs(folder, exist_ok=True)
+    # tên part theo thời gian để thứ tự đọc ra đúng thứ tự ghi
+    part = folder + os.sep + f"part-{time.time_ns()}.parquet"
+    df.to_parquet(part, index=False)
+
+
+# Chép lại file CSV với header mới (thêm cột, ô trống), đọc / ghi theo khối
+# Chỉ xảy ra khi schema có thêm cột so với file CSV đã có
+def _widen_csv(path, header):
+    tmp = path + ".tmp"
+    first = True
+    for chunk in pd.read_csv(path, dtype="string", encoding="utf-8-sig", chunksize=100_000):
+        chunk.reindex(columns=header).to_csv(tmp, mode="w" if first else "a", index=False,
+                                             header=first, encoding="utf-8-sig" if first else "utf-8")
+        first = False
+    os.replace(tmp, path)
+
+
+def _append_csv(df, name):
+    path = csv_path(name)
+    new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+    if not new_file:
+        # cột của lô mới phải khớp header của file đã có (cùng thứ tự, thiếu thì để trống)
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            header = next(csv.reader(f))
+        extra = [c for c in df.columns if c not in header]
+        if extra:
+            header += extra
+            _widen_csv(path, header)
+        df = df.reindex(columns=header)
+    # BOM chỉ ghi ở đầu file mới, không ghi lại khi nối thêm
+    df.to_csv(path, mode="a", index=False, header=new_file,
+              encoding="utf-8-sig" if new_file else "utf-8")
+
+
+# Cột theo thứ tự schema (cột thiếu thêm vào với giá trị NA) rồi tới các cột ngoài schema,
+# để mọi part / dòng CSV của 1 bảng có cùng các cột
+def _conform(df, schema):
+    if schema:
+        # cột thiếu tạo dạng chuỗi NA rồi mới ép kiểu (reindex sẽ tạo float NaN, cột category
+        # khi đó có categories kiểu số, không gộp được với các part khác)
+        missing = {c: pd.Series(pd.NA, index=df.index, dtype="string")
+                   for c in schema if c not in df.columns}
+        df = df.assign(**missing)[list(schema) + [c for c in df.columns if c not in schema]]
+    return apply_schema(df, schema)
+
+
+# Ghi đè cả bảng
+def write_table(df, name):
+    df = _conform(df, SCHEMAS.get(name, {}))
+    clear_table(name)
+    os.makedirs(data_folder, exist_ok=True)
+    if HAS_PARQUET:
+        _write_part(df, name)
+    if export_csv or not HAS_PARQUET:
+        _append_csv(df, name)
+
+
+# Nối thêm 1 lô dòng vào cuối bảng (mỗi lô là 1 file part)
+def append_table(df, name):
+    df = _conform(df, SCHEMAS.get(name, {}))
+    os.makedirs(data_folder, exist_ok=True)
+    if HAS_PARQUET:
+        _write_part(df, name)
+    if export_csv or not HAS_PARQUET:
+        _append_csv(df, name)
+
+
+# Cột category có thể được ghi với kiểu mã khác nhau giữa các part (int8 / int16)
+# -> ghi dạng giá trị để các part gộp chung 1 schema (đọc lại vẫn ép về category theo schema)
+def _plain_type(t):
+    return t.value_type if pa.types.is_dictionary(t) else t
+
+
+def _plain_table(table):
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+    return table
+
+
+# Chép lần lượt từng part vào 1 file qua ParquetWriter (chỉ giữ 1 part trong bộ nhớ),
+# file gộp thay vào chỗ part đầu tiên nên thứ tự dòng không đổi
+# Part cũ có thể thiếu cột mới thêm vào schema: schema chung lấy từ footer của mọi part,
+# cột thiếu điền null
+def _merge_parts(parts):
+    schemas = [pq.read_schema(p) for p in parts]
+    schema = pa.unify_schemas(
+        [pa.schema([pa.field(f.name, _plain_type(f.type)) for f in sc]) for sc in schemas],
+        promote_options="permissive")
+    # giữ metadata pandas của part có nhiều cột nhất (để đọc lại đúng kiểu Int64 / string)
+    schema = schema.with_metadata(max(schemas, key=len).metadata)
+    tmp = parts[0] + ".tmp"
+    with pq.ParquetWriter(tmp, schema) as writer:
+        for part in parts:
+            table = _plain_table(pq.read_table(part))
+            for field in schema:
+                if field.name not in table.column_names:
+                    table = table.append_column(field.name, pa.nulls(len(table), field.type))
+            writer.write_table(table.select(schema.names).cast(schema))
+    os.replace(tmp, parts[0])
+    for p in parts[1:]:
+        os.remove(p)
+
+
+# Gộp các dãy part nhỏ liền nhau (sinh ra khi nối thêm nhiều lần) khi đủ min_parts part
+# Part lớn (và dãy chưa đủ dài) giữ nguyên, nên chi phí không tăng theo kích thước bảng
+def compact_table(name, min_parts=None, small_rows=None):
+    folder = parquet_path(name)
+    if not HAS_PARQUET or not os.path.isdir(folder):
+        return
+    min_parts = compact_min_parts if min_parts is None else min_parts
+    small_rows = small_part_rows if small_rows is None else small_rows
+    run = []
+    for part in sorted(glob.glob(folder + os.sep + "part-*.parquet")) + [None]:
+        # số dòng lấy từ footer, không đọc dữ liệu
+        if part is not None and pq.ParquetFile(part).metadata.num_rows < small_rows:
+            run.append(part)
+            continue
+        if len(run) >= max(min_parts, 2):
+            _merge_parts(run)
+        run = []
+
+
+# Đọc bảng, chỉ lấy các cột cần (columns=None: lấy hết)
+# Ưu tiên Parquet; nếu chưa có thì đọc CSV và ép kiểu theo schema
+def load_table(name, columns=None):
+    schema = SCHEMAS.get(name, {})
+    folder = parquet_path(name)
+    if HAS_PARQUET and os.path.isdir(folder):
+        parts = sorted(glob.glob(folder + os.sep + "part-*.parquet"))
+        if not parts:
+            return pd.DataFrame(columns=columns or list(schema))
+        frames = [pd.read_parquet(p, columns=columns) for p in parts]
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        return apply_schema(df, schema)
+
+    path = csv_path(name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Không tìm thấy bảng {name}: {folder} / {path}")
+    # đọc chuỗi / category rồi ép kiểu theo schema để không phải đoán kiểu
+    dtype = csv_dtypes(schema)
+    df = pd.read_csv(path, usecols=columns, dtype=dtype, encoding="utf-8-sig")
+    return apply_schema(df, schema)
+
+
+# Đọc bảng theo từng khối chunk_size dòng (không nạp cả bảng vào bộ nhớ)
+# start: bỏ qua start dòng đầu; với Parquet các part / row group nằm trọn trong đoạn bỏ qua
+# không được đọc (số dòng lấy từ footer)
+def iter_table(name, columns=None, chunk_size=100_000, start=0):
+    schema = SCHEMAS.get(name, {})
+    folder = parquet_path(name)
+    if HAS_PARQUET and os.path.isdir(folder):
+        for part in sorted(glob.glob(folder + os.sep + "part-*.parquet")):
+            f = pq.ParquetFile(part)
+            groups = []
+            for i in range(f.num_row_groups):
+                n = f.metadata.row_group(i).num_rows
+                if start >= n and not groups:
+                    start -= n
+                else:
+                    groups.append(i)
+            if not groups:
+                continue
+            for batch in f.iter_batches(batch_size=chunk_size, columns=columns, row_groups=groups):
+                if start >= batch.num_rows:
+                    start -= batch.num_rows
+                    continue
+                if start:
+                    batch, start = batch.slice(start), 0
+                yield apply_schema(batch.to_pandas(), schema)
+        return
+
+    path = csv_path(name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Không tìm thấy bảng {name}: {folder} / {path}")
+    dtype = csv_dtypes(schema)
+    for chunk in pd.read_csv(path, usecols=columns, dtype=dtype, encoding="utf-8-sig",
+                             chunksize=chunk_size, skiprows=range(1, start + 1)):
+        yield apply_schema(chunk, schema)
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+import clustering
+import location
+import storage
+from running_stats import RunningStats
+
+input_table = "du_lieu_oto"
+state_path = storage.data_folder + os.sep + "summaries_state.json"
+model_path = storage.data_folder + os.sep + "segment_model.joblib"
+output_path = os.path.dirname(__file__) + os.sep + "phan_tich_phan_khuc.csv"
+
+value_cols = ["Giá", "Năm SX", "Số km đã đi"]  # cũng là các cột của mô hình phân khúc
+chunk_size = 100_000
+state_version = 2
+
+
+# Thống kê gộp được (RunningStats) cho từng (chiều, nhóm, cột)
+# chiều: "year" (Năm SX), "region" (Khu vực), "segment" (Phân khúc theo mô hình K-means)
+class GroupedStats:
+    def __init__(self, groups=None):
+        self.groups = groups or {"year": {}, "region": {}, "segment": {}}
+
+    # Gộp 1 khối dữ liệu: mỗi nhóm tính count / mean / M2 / min / max bằng 1 lượt groupby
+    def update(self, dim, keys, values):
+        values = values.astype("float64")
+        grouped = values.groupby(keys.to_numpy(), sort=False)
+        count, mean, var = grouped.count(), grouped.mean(), grouped.var(ddof=0)
+        low, high = grouped.min(), grouped.max()
+        target = self.groups[dim]
+        for key in count.index:
+            cols = target.setdefault(str(key), {})
+            for col in values.columns:
+                n = int(count.at[key, col])
+                if n == 0:
+                    continue
+                batch = RunningStats(n, mean.at[key, col], var.at[key, col] * n,
+                                     low.at[key, col], high.at[key, col])
+                cols.setdefault(col, RunningStats()).merge(batch)
+
+    # Chiều năm và khu vực (không phụ thuộc mô hình phân khúc)
+    def update_chunk(self, chunk):
+        values = chunk[value_cols]
+        has_year = chunk["Năm SX"].notna().to_numpy()
+        self.update("year", chunk["Năm SX"][has_year].astype("int64"), values[has_year])
+        # khu vực / phân khúc thiếu (NaN, None) bị groupby bỏ qua
+        self.update("region", location.khuvuc_column(chunk["Địa điểm"]).astype(object), values)
+
+    def update_segments(self, chunk, model):
+        self.update("segment", clustering.assign(model, chunk), chunk[value_cols])
+
+    # Bảng thống kê của 1 chiều: mỗi dòng 1 nhóm, cột "<cột>_count/_mean/_std/_min/_max"
+    def table(self, dim):
+        rows = []
+        for key, cols in self.groups[dim].items():
+            row = {"key": key}
+            for col, st in cols.items():
+                row.update({f"{col}_count": st.count, f"{col}_mean": st.mean, f"{col}_std": st.std,
+                            f"{col}_min": st.min, f"{col}_max": st.max})
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def to_dict(self):
+        return {dim: {key: {col: st.to_dict() for col, st in cols.items()}
+                      for key, cols in groups.items()}
+                for dim, groups in self.groups.items()}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls({dim: {key: {col: RunningStats.from_dict(st) for col, st in cols.items()}
+                          for key, cols in groups.items()}
+                    for dim, groups in d.items()})
+
+
+def file_hash(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def row_hashes(chunk):
+    return pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+
+
+def new_state():
+    return {
+        "version": state_version,
+        "n_rows": 0,                                  # số dòng đầu đã gộp vào thống kê
+        "rows_hash": hashlib.sha256().hexdigest(),    # hash của n_rows dòng đó
+        "groups": GroupedStats().to_dict(),           # chiều year / region
+        "model": None,                                # hash file mô hình của chiều segment
+        "segment_rows": 0,                            # số dòng đầu đã gộp vào chiều segment
+        "segment_groups": {},
+    }
+
+
+def load_state():
+    if os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") == state_version:
+            return state
+    return None
+
+
+def save_state(state):
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+
+
+# Gộp các dòng chưa có trong state vào thống kê, đọc du_lieu_oto 1 lượt
+# n_rows dòng đầu phải giống lúc đã gộp (như chuan_hoa.py: hash từng dòng nối tiếp nhau),
+# kiểm tra tại khối chứa dòng cuối của tiền tố, trước khi gộp dòng mới nào
+# Chiều segment theo mô hình K-means: mô hình đổi thì chỉ tính lại chiều này từ đầu,
+# chiều year / region giữ nguyên
+# Trả về state mới, hoặc None nếu dữ liệu cũ đã đổi (cần tính lại từ đầu)
+def fold(state, model_key):
+    n_done = state["n_rows"]
+    stats = GroupedStats.from_dict(state["groups"])
+    if state["model"] == model_key:
+        seg_done = state["segment_rows"]
+        segments = GroupedStats.from_dict({"segment": state["segment_groups"]})
+    else:
+        seg_done = 0
+        segments = GroupedStats()
+    model = clustering.load_model(model_path, value_cols) if model_key is not None else None
+
+    h = hashlib.sha256()
+    offset = 0
+    for chunk in storage.iter_table(input_table, columns=value_cols + ["Địa điểm"],
+                                    chunk_size=chunk_size):
+        hashes = row_hashes(chunk)
+        if offset < n_done <= offset + len(chunk):
+            h.update(hashes[:n_done - offset].tobytes())
+            if h.hexdigest() != state["rows_hash"]:
+                return None
+            h.update(hashes[n_done - offset:].tobytes())
+        else:
+            h.update(hashes.tobytes())
+        if offset + len(chunk) > n_done:
+            stats.update_chunk(chunk.iloc[max(0, n_done - offset):])
+        if model is not None and offset + len(chunk) > seg_done:
+            segments.update_segments(chunk.iloc[max(0, seg_done - offset):], model)
+        offset += len(chunk)
+    if offset < n_done:
+        return None
+
+    return dict(state, n_rows=offset, rows_hash=h.hexdigest(), groups=stats.to_dict(),
+                model=model_key, segment_rows=offset,
+                segment_groups=segments.to_dict()["segment"])
+
+
+# Cập nhật thống kê với các dòng mới của du_lieu_oto
+# Tính lại từ đầu khi chưa có state hoặc các dòng đã gộp bị đổi / xóa (dữ liệu làm sạch lại)
+def refresh(rebuild=False):
+    model_key = file_hash(model_path)
+    state = None if rebuild else load_state()
+    if state is not None:
+        state = fold(state, model_key)
+    if state is None:
+        state = fold(new_state(), model_key)
+    save_state(state)
+    groups = state["groups"]
+    return GroupedStats.from_dict(dict(groups, segment=state["segment_groups"]))
+
+
+# Giá TB / SL / std theo năm (thay cho groupby trong plot_graph.py)
+def year_table(stats):
+    t = stats.table("year")
+    if t.empty:
+        return pd.DataFrame(columns=["Năm SX", "mean", "count", "std"])
+    g = pd.DataFrame({
+        "Năm SX": t["key"].astype("int64"),
+        "mean": t["Giá_mean"],
+        "count": t["Giá_count"],
+        "std": t["Giá_std"],
+    })
+    return g.sort_values("Năm SX").dropna().reset_index(drop=True)
+
+
+# Bảng phân tích phân khúc giống phan_tich_phan_khuc.csv (giá theo triệu đồng)
+def segment_table(stats):
+    t = stats.table("segment")
+    if t.empty:
+        return pd.DataFrame()
+    return pd.DataFrame({
+        "so_xe": t["Giá_count"].astype("int64"),
+        "Giá TB (triệu)": t["Giá_mean"] / 1_000_000,
+        "Năm SX TB": t["Năm SX_mean"],
+        "Km TB": t["Số km đã đi_mean"],
+        "Giá Min (triệu)": t["Giá_min"] / 1_000_000,
+        "Giá Max (triệu)": t["Giá_max"] / 1_000_000,
+        "Phân khúc": t["key"],
+    }).sort_values("Giá TB (triệu)").reset_index(drop=True)
+
+
+def export_segments(stats):
+    table = segment_table(stats)
+    table.to_csv(output_path, index=False, encoding="utf-8-sig")
+    return table
+
+
+if __name__ == "__main__":
+    stats = refresh()
+    print(export_segments(stats))
+    print(year_table(stats))